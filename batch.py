@@ -0,0 +1,124 @@
+"""Headless batch processing of order PDFs.
+
+Usage:
+    python batch.py orders/ --output out/ --concurrency 8
+    python batch.py manifest.csv --output out/
+
+A directory is scanned for ``*.pdf`` files; a sibling ``<name>.txt`` or ``<name>.eml``
+is used as the email text (the subject and body of an ``.eml``). A manifest is a CSV
+file with ``pdf`` and optional ``email`` columns holding file paths. Orders whose
+output XML already exists are skipped, so an interrupted run resumes where it stopped.
+Output that is malformed or breaks the schema rules is written to
+``<name>_processed.failed.xml`` instead and redone, without the result cache, on the
+next run. Overloaded and failing API calls are retried per request (LLM_MAX_ATTEMPTS,
+within LLM_DEADLINE per order).
+"""
+import argparse
+import asyncio
+import csv
+import os
+import sys
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from utils.llm_utils import aprocess
+from utils.mail_utils import order_parts, parser
+from utils.schema_utils import fix_order_xml
+from utils.xml_utils import save_xml
+
+
+def find_orders(source):
+    source = Path(source)
+    orders = []
+    if source.is_dir():
+        for pdf_path in sorted(source.glob("*.pdf")):
+            email_path = next((path for path in (pdf_path.with_suffix(".txt"), pdf_path.with_suffix(".eml"))
+                               if path.exists()), None)
+            orders.append((pdf_path, email_path))
+    else:
+        with open(source, newline="", encoding="utf-8") as file:
+            for row in csv.DictReader(file):
+                email = (row.get("email") or "").strip()
+                # Manifest paths are relative to the manifest itself.
+                orders.append((source.parent / row["pdf"].strip(), source.parent / email if email else None))
+    return orders
+
+
+def output_path(output_dir, pdf_path):
+    return Path(output_dir) / f"{pdf_path.stem}_processed.xml"
+
+
+def failed_path(output_dir, pdf_path):
+    return Path(output_dir) / f"{pdf_path.stem}_processed.failed.xml"
+
+
+def read_email_text(email_path):
+    if email_path.suffix.lower() == ".eml":
+        # Only the subject and text body; headers and attachments are not order text.
+        with open(email_path, "rb") as file:
+            return order_parts(parser.parse(file))[1]
+    return email_path.read_text(encoding="utf-8", errors="ignore").strip() or None
+
+
+def order_errors(xml_output):
+    # The schema rules still broken after the pipeline's own fixes and repair.
+    try:
+        return [f"{error['field']}: {error['message']}" for error in fix_order_xml(xml_output)[2]]
+    except ET.ParseError as e:
+        return [f"malformed XML: {e}"]
+
+
+async def process_order(pdf_path, email_path, output_dir, semaphore):
+    target, failed = output_path(output_dir, pdf_path), failed_path(output_dir, pdf_path)
+    email_text = read_email_text(email_path) if email_path is not None else None
+
+    async with semaphore:
+        # A cached result would give back the same failing output.
+        xml_output = await aprocess(pdf_path, email_text, use_cache=not failed.exists())
+
+    errors = order_errors(xml_output)
+    # Write next to the target and rename, so a crash never leaves a partial file
+    # that would be mistaken for a finished order on resume.
+    tmp_path = target.with_suffix(".xml.tmp")
+    save_xml(xml_output, str(tmp_path))
+    if errors:
+        os.replace(tmp_path, failed)
+        raise ValueError(f"invalid output ({'; '.join(errors)}), kept in {failed.name}")
+    os.replace(tmp_path, target)
+    failed.unlink(missing_ok=True)
+
+
+async def run_batch(orders, output_dir, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    pending = [(pdf_path, email_path) for pdf_path, email_path in orders
+               if not output_path(output_dir, pdf_path).exists()]
+    print(f"{len(orders)} orders found, {len(orders) - len(pending)} already done, {len(pending)} to process")
+
+    results = await asyncio.gather(*(
+        process_order(pdf_path, email_path, output_dir, semaphore)
+        for pdf_path, email_path in pending
+    ), return_exceptions=True)
+
+    failures = 0
+    for (pdf_path, _), result in zip(pending, results):
+        if isinstance(result, Exception):
+            failures += 1
+            print(f"❌ {pdf_path.name}: {result}")
+    print(f"Done: {len(pending) - failures} processed, {failures} failed")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process a directory or CSV manifest of order PDFs.")
+    parser.add_argument("source", help="Directory of PDFs or CSV manifest with pdf,email columns")
+    parser.add_argument("--output", default="output", help="Directory for the generated XML files")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum orders in flight")
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    orders = find_orders(args.source)
+    failures = asyncio.run(run_batch(orders, args.output, args.concurrency))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""Synthetic order corpus.
+
+Usage (from the repo root):
+    python -m benchmarks.corpus bench_corpus --pages 1 5 20 100 --scanned 0.2
+
+Writes ``<name>.pdf`` plus the matching expected ``<name>.xml`` for every document.
+Born-digital pages carry a text layer; scanned pages are JPEG images without one.
+``--terms N`` appends N pages of general terms and conditions to every order.
+"""
+import argparse
+import random
+from io import BytesIO
+from pathlib import Path
+from PIL import Image, ImageDraw, ImageFilter
+from utils.xml_utils import build_order_xml
+
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+LINES_PER_PAGE = 28
+SCAN_DPI = 150
+
+STREETS = ["Sacrèstraat", "Rue de l'Église", "Brugsesteenweg", "Avenue Émile Max", "Boulevard Léopold II",
+           "Kerkstraat", "Chaussée de Louvain", "Hoogstraat", "Rue des Pêcheurs", "Vijverweg"]
+CITIES = [("1000", "Brussel", "BE"), ("9000", "Gent", "BE"), ("2000", "Antwerpen", "BE"),
+          ("4000", "Liège", "BE"), ("1012 AB", "Amsterdam", "NL"), ("3511 CE", "Utrecht", "NL")]
+COMPANIES = ["Voorbeeld BV", "Informatique Namur SA", "De Smet & Zonen NV", "Bureau Hélène Dupré", "Techniek Brûlé"]
+CONTACTS = ["Jan Jansen", "Élodie Lefèvre", "Pieter De Wit", "Zoë Maes"]
+PRODUCTS = ["HPE Aruba 6300F 48P 1G Switch", "Lenovo ThinkPad T14 Gen 4 i7 16GB 512GB", "Cisco Catalyst 9200L 24P PoE+",
+            "Dell 27\" Monitor P2723DE", "Ubiquiti UniFi U6 Pro Access Point", "APC Smart-UPS 1500VA LCD",
+            "Logitech MX Keys Toetsenbord AZERTY", "Samsung 990 PRO 2TB NVMe SSD", "Netgear GS108 8P Gigabit"]
+TERMS = [
+    "Deze voorwaarden zijn van toepassing op alle aanbiedingen, bestellingen en overeenkomsten van koper.",
+    "Afwijkingen van deze voorwaarden zijn slechts geldig indien deze uitdrukkelijk schriftelijk zijn overeengekomen.",
+    "Levering geschiedt op het in de bestelling vermelde afleveradres, op de overeengekomen leverdatum.",
+    "Het risico van de zaken gaat pas over op koper nadat deze door koper in ontvangst zijn genomen.",
+    "Koper is gerechtigd de zaken bij aflevering te keuren; afgekeurde zaken worden voor rekening van de leverancier geretourneerd.",
+    "Facturen worden binnen dertig dagen na ontvangst en goedkeuring van de geleverde zaken betaald.",
+    "De leverancier staat ervoor in dat de geleverde zaken voldoen aan de overeenkomst en aan de geldende wettelijke eisen.",
+    "Op alle overeenkomsten is uitsluitend Nederlands recht van toepassing; geschillen worden voorgelegd aan de bevoegde rechter.",
+]
+
+
+def euro(value):
+    return f"{value:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+
+
+def make_order(rng, name, page_count):
+    postalcode, city, country = rng.choice(CITIES)
+    order_number = f"P{rng.randint(10000000, 99999999)}"
+    # Fill every page: page one holds the header block, later pages repeat the table
+    # header, and one row is left for the total.
+    header_rows = 12
+    line_count = max(1, (LINES_PER_PAGE - header_rows) + (page_count - 1) * (LINES_PER_PAGE - 1) - 1)
+    return {
+        "name": name,
+        "supplier": "6010" if country == "BE" else "COPACO",
+        "customer_ordernumber": order_number,
+        "orderdate": f"{rng.randint(1, 28):02d}-{rng.randint(1, 12):02d}-2025",
+        "requested_deliverydate": f"{rng.randint(1, 28):02d}-{rng.randint(1, 12):02d}-2025",
+        "recipientsreference": rng.choice(["Own use", f"V00{rng.randint(10000, 99999)} / #PO{rng.randint(100, 999)}"]),
+        "customerid": str(rng.randint(1000, 999999)),
+        "shipto": {
+            "name1": rng.choice(COMPANIES),
+            "name2": rng.choice(CONTACTS),
+            "street": f"{rng.choice(STREETS)} {rng.randint(1, 250)}",
+            "postalcode": postalcode,
+            "city": city,
+            "country": country,
+        },
+        "lines": [{
+            "item_id": f"{rng.choice('ABCDJKLMNXY')}{rng.randint(100, 9999)}{rng.choice('ABC')}",
+            "item_description": rng.choice(PRODUCTS),
+            "quantity": str(rng.randint(1, 50)),
+            "price": f"{rng.uniform(5, 3000):.2f}",
+            "bid": "NVT",
+        } for _ in range(line_count)],
+    }
+
+
+def page_lines(order):
+    # Yields the text rows of each page, mirroring the layout the template engine knows.
+    header = [
+        "Copaco Belgium NV" if order["supplier"] == "6010" else "Copaco Nederland B.V.",
+        f"Bestelnummer: {order['customer_ordernumber']}",
+        f"Besteldatum: {order['orderdate']}",
+        f"Leverdatum: {order['requested_deliverydate']}",
+        f"Referentie: {order['recipientsreference']}",
+        f"Klantnummer: {order['customerid']}",
+        "Afleveradres:",
+        order["shipto"]["name1"],
+        f"T.a.v.: {order['shipto']['name2']}",
+        order["shipto"]["street"],
+        f"{order['shipto']['postalcode']} {order['shipto']['city']}",
+    ]
+    rows = [
+        f"{line['item_id']} {line['item_description']} {line['quantity']} "
+        f"{euro(float(line['price']))} {euro(float(line['price']) * int(line['quantity']))}"
+        for line in order["lines"]
+    ]
+    total = sum(float(line["price"]) * int(line["quantity"]) for line in order["lines"])
+    rows.append(f"Totaal {euro(total)}")
+
+    pages, current = [], header
+    current.append("Code Omschrijving Aantal Prijs Bedrag")
+    for row in rows:
+        if len(current) >= LINES_PER_PAGE:
+            pages.append(current)
+            current = ["Code Omschrijving Aantal Prijs Bedrag"]
+        current.append(row)
+    pages.append(current)
+    return pages
+
+
+def terms_pages(count):
+    # Identical prose for every order, like the conditions resellers append to each PDF.
+    pages, article = [], 1
+    for page_num in range(count):
+        lines = ["Algemene Inkoopvoorwaarden", ""] if page_num == 0 else []
+        while len(lines) < LINES_PER_PAGE - 1:
+            lines.append(f"Artikel {article}")
+            lines.extend(TERMS[(article + i) % len(TERMS)] for i in range(2))
+            article += 1
+        lines.append(f"Pagina {page_num + 1} van {count}")
+        pages.append(lines)
+    return pages
+
+
+def pdf_string(text):
+    escaped = text.encode("cp1252", errors="replace")
+    return b"(" + escaped.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+def text_page_content(lines):
+    content = [b"BT /F1 10 Tf 14 TL 50 790 Td"]
+    for line in lines:
+        content.append(pdf_string(line) + b" Tj T*")
+    content.append(b"ET")
+    return b"\n".join(content)
+
+
+def scanned_page_image(rng, lines):
+    scale = SCAN_DPI / 72
+    image = Image.new("L", (int(PAGE_WIDTH * scale), int(PAGE_HEIGHT * scale)), 255)
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(lines):
+        draw.text((50 * scale, (52 + 14 * i) * scale), line, fill=0)
+    image = image.rotate(rng.uniform(-1.5, 1.5), fillcolor=255).filter(ImageFilter.GaussianBlur(0.6))
+    noise = Image.effect_noise(image.size, 18)
+    image = Image.blend(image, noise, 0.08)
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=70)
+    return image.size, buffer.getvalue()
+
+
+def build_pdf(rng, pages, scanned_ratio):
+    objects = [None, None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>"]
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    def stream(data, attributes=b""):
+        return b"<< /Length %d %s>>\nstream\n" % (len(data), attributes) + data + b"\nendstream"
+
+    page_ids = []
+    for page_num, lines in enumerate(pages):
+        # The first page always keeps its text layer, like most real scans with a cover sheet.
+        if page_num and rng.random() < scanned_ratio:
+            (width, height), jpeg = scanned_page_image(rng, lines)
+            image_id = add(stream(jpeg, b"/Type /XObject /Subtype /Image /Width %d /Height %d "
+                                        b"/ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /DCTDecode "
+                                  % (width, height)))
+            content_id = add(stream(b"q %d 0 0 %d 0 0 cm /Im0 Do Q" % (PAGE_WIDTH, PAGE_HEIGHT)))
+            resources = b"<< /XObject << /Im0 %d 0 R >> >>" % image_id
+        else:
+            content_id = add(stream(text_page_content(lines)))
+            resources = b"<< /Font << /F1 3 0 R >> >>"
+        page_ids.append(add(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Contents %d 0 R /Resources %s >>"
+                            % (PAGE_WIDTH, PAGE_HEIGHT, content_id, resources)))
+
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % page_id for page_id in page_ids), len(page_ids))
+
+    output = BytesIO()
+    output.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for object_id, body in enumerate(objects, start=1):
+        offsets.append(output.tell())
+        output.write(b"%d 0 obj\n" % object_id + body + b"\nendobj\n")
+    xref = output.tell()
+    output.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        output.write(b"%010d 00000 n \n" % offset)
+    output.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return output.getvalue()
+
+
+def generate(output_dir, page_counts, per_size=1, scanned_ratio=0.0, seed=42, terms=0):
+    rng = random.Random(seed)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for page_count in page_counts:
+        for index in range(per_size):
+            name = f"order_{page_count:03d}p_{index:02d}"
+            order = make_order(rng, name, page_count)
+            pages = page_lines(order) + terms_pages(terms)
+            (output_dir / f"{name}.pdf").write_bytes(build_pdf(rng, pages, scanned_ratio))
+            (output_dir / f"{name}.xml").write_text(build_order_xml(order), encoding="utf-8")
+            paths.append(output_dir / f"{name}.pdf")
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic order PDF corpus.")
+    parser.add_argument("output", help="Directory for the generated PDF/XML pairs")
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 2, 5, 10, 20, 50, 100])
+    parser.add_argument("--per-size", type=int, default=1, help="Documents per page count")
+    parser.add_argument("--scanned", type=float, default=0.0, help="Share of pages rendered as scanned images")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--terms", type=int, default=0, help="Pages of terms and conditions appended to every order")
+    args = parser.parse_args()
+
+    paths = generate(args.output, args.pages, args.per_size, args.scanned, args.seed, args.terms)
+    print(f"Wrote {len(paths)} documents to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Peak-memory check for the PDF stages.
+
+Usage (from the repo root):
+    python -m benchmarks.memory --pages 5 20 50 100 --max-growth-mb 64
+
+Generates fully scanned orders of increasing length and runs each through
+llm_utils.process() in a fresh interpreter (ru_maxrss is a per-process high-water
+mark) against an in-process stand-in for the Messages API. Prints the peak RSS
+per page count and exits non-zero when the largest order needs more than
+--max-growth-mb above the smallest one.
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+
+def run_child(pdf_path):
+    os.environ.setdefault("ANTHROPIC_API_KEY", "stub")
+    os.environ.update({"ORDER_CACHE_DISABLED": "1", "METRICS_FILE": "", "TEMPLATE_ENGINE": "0",
+                       "BOILERPLATE_FILTER": "0", "SCHEMA_REPAIR": "0"})
+    from benchmarks.stub_api import serve
+
+    server = serve(port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["ANTHROPIC_BASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}"
+
+    from utils.llm_utils import process
+    from utils.telemetry_utils import recent_traces
+
+    with contextlib.redirect_stdout(sys.stderr):
+        process(pdf_path)
+    trace = recent_traces[-1]
+    print(json.dumps({
+        "pages": trace.get("pages"),
+        "pages_rendered": trace.get("pages_rendered"),
+        "chunks": trace.get("chunks"),
+        "spooled_to_disk": trace.get("spooled_to_disk"),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        # poppler runs as a child process and streams its pages, so it is reported apart.
+        "peak_child_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }))
+
+
+def measure(pdf_path):
+    result = subprocess.run([sys.executable, "-m", "benchmarks.memory", "--child", str(pdf_path)],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that peak memory stays flat as page count grows.")
+    parser.add_argument("--pages", type=int, nargs="+", default=[5, 20, 50, 100])
+    parser.add_argument("--max-growth-mb", type=float, default=64.0,
+                        help="Allowed peak RSS growth from the smallest to the largest order")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child)
+        return
+
+    from benchmarks.corpus import build_pdf, make_order, page_lines
+
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for page_count in sorted(args.pages):
+            rng = random.Random(page_count)
+            pdf_path = Path(directory) / f"scan_{page_count:03d}p.pdf"
+            pdf_path.write_bytes(build_pdf(rng, page_lines(make_order(rng, pdf_path.stem, page_count)), 1.0))
+            rows.append(measure(pdf_path))
+
+    print(f"{'pages':>6} {'chunks':>7} {'spooled':>8} {'peak MB':>9} {'poppler MB':>11}")
+    for row in rows:
+        print(f"{row['pages']:>6} {row['chunks'] or 0:>7} {str(bool(row['spooled_to_disk'])):>8} "
+              f"{row['peak_rss_mb']:>9.1f} {row['peak_child_rss_mb']:>11.1f}")
+
+    growth = rows[-1]["peak_rss_mb"] - rows[0]["peak_rss_mb"]
+    print(f"Peak RSS growth from {rows[0]['pages']} to {rows[-1]['pages']} pages: {growth:.1f} MB "
+          f"(limit {args.max_growth_mb:.0f} MB)")
+    if growth > args.max_growth_mb:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""End-to-end pipeline benchmark.
+
+Usage (from the repo root):
+    python -m benchmarks.corpus bench_corpus --pages 1 5 20 100 --scanned 0.2
+    python -m benchmarks.pipeline bench_corpus --latency 0.5 --output bench.json
+
+Every PDF in the corpus goes through the same stages as llm_utils.process(), each
+timed separately, against a local stand-in for the Messages API (started in-process
+unless --base-url points at a running one). The report is printed as JSON.
+"""
+import argparse
+import json
+import math
+import os
+import resource
+import sys
+import threading
+import time
+from pathlib import Path
+
+os.environ.setdefault("ANTHROPIC_API_KEY", "stub")
+
+from anthropic import Anthropic
+from benchmarks.stub_api import load_responses, serve
+from utils.llm_utils import MODEL, build_query, build_request
+from utils.pdf_utils import PageSpool, format_page_texts, iter_rasterize, load_document, page_encoder
+from utils.xml_utils import validate_xml
+
+
+STAGES = ["pdf_to_text", "pdf_to_images", "base64_encode", "request_build", "api_call", "validate_xml"]
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else 0.0,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "max": max(values, default=0.0),
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux; poppler runs as a child process, so report both.
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return own, children
+
+
+def run_document(client, pdf_path):
+    timings = {}
+
+    start = time.perf_counter()
+    pdf_data, page_texts = load_document(pdf_path)
+    pdf_text = format_page_texts(page_texts)
+    timings["pdf_to_text"] = time.perf_counter() - start
+
+    # Pages stream from poppler into a spool one at a time, as in llm_utils.render_document;
+    # the wait for each page and its encoding are timed separately and summed.
+    timings["pdf_to_images"] = timings["base64_encode"] = 0.0
+    encoder, spool = page_encoder(len(page_texts)), PageSpool()
+    pages, page = iter_rasterize(pdf_data), 1
+    while True:
+        start = time.perf_counter()
+        image = next(pages, None)
+        timings["pdf_to_images"] += time.perf_counter() - start
+        if image is None:
+            break
+        start = time.perf_counter()
+        spool.add(encoder(image) | {"page": page})
+        timings["base64_encode"] += time.perf_counter() - start
+        page += 1
+
+    start = time.perf_counter()
+    request = build_request(build_query(spool.load(), pdf_text))
+    payload_bytes = len(json.dumps(request))
+    timings["request_build"] = time.perf_counter() - start
+    spool.close()
+
+    start = time.perf_counter()
+    response = client.messages.create(**request)
+    timings["api_call"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    valid = validate_xml(response.content[0].text)
+    timings["validate_xml"] = time.perf_counter() - start
+
+    return timings, len(page_texts), payload_bytes, valid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time each pipeline stage over a PDF corpus.")
+    parser.add_argument("corpus", help="Directory of PDFs (and expected XML) from benchmarks.corpus")
+    parser.add_argument("--repeat", type=int, default=1, help="Passes over the corpus")
+    parser.add_argument("--base-url", help="Use a running Messages endpoint instead of an in-process stub")
+    parser.add_argument("--latency", type=float, default=0.0, help="In-process stub latency in seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="In-process stub generation speed")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    pdf_paths = sorted(Path(args.corpus).glob("*.pdf"))
+    if not pdf_paths:
+        sys.exit(f"No PDFs found in {args.corpus}")
+
+    base_url = args.base_url
+    if base_url is None:
+        server = serve(port=0, latency=args.latency, tokens_per_second=args.tokens_per_second,
+                       responses=load_responses(args.corpus))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    client = Anthropic(base_url=base_url, max_retries=0)
+
+    stage_times = {stage: [] for stage in STAGES}
+    document_times, pages, payload_bytes, invalid = [], 0, 0, 0
+    wall_start = time.perf_counter()
+    for _ in range(args.repeat):
+        for pdf_path in pdf_paths:
+            timings, page_count, size, valid = run_document(client, pdf_path)
+            for stage, elapsed in timings.items():
+                stage_times[stage].append(elapsed)
+            document_times.append(sum(timings.values()))
+            pages += page_count
+            payload_bytes += size
+            invalid += not valid
+    wall = time.perf_counter() - wall_start
+
+    own_rss, child_rss = peak_rss_mb()
+    report = {
+        "model": MODEL,
+        "documents": len(document_times),
+        "pages": pages,
+        "invalid_xml": invalid,
+        "wall_seconds": wall,
+        "throughput": {
+            "documents_per_second": len(document_times) / wall,
+            "pages_per_second": pages / wall,
+        },
+        "payload_bytes_mean": payload_bytes / len(document_times),
+        "document_seconds": summarize(document_times),
+        "stages": {stage: summarize(values) for stage, values in stage_times.items()},
+        "peak_rss_mb": own_rss,
+        "peak_child_rss_mb": child_rss,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Rasterization benchmark.
+
+Usage (from the repo root):
+    python -m benchmarks.rasterize path/to/order.pdf --pages 1 5 15 40 --workers 1 2 4 8
+"""
+import argparse
+import os
+import time
+from io import BytesIO
+from PyPDF2 import PdfReader, PdfWriter
+from utils.pdf_utils import render_pages
+
+
+MODES = ["sequential", "thread", "process", "document"]
+
+
+def build_document(pdf_reader, page_count):
+    # Repeat the source pages until the requested page count is reached.
+    writer = PdfWriter()
+    for i in range(page_count):
+        writer.add_page(pdf_reader.pages[i % len(pdf_reader.pages)])
+    output = BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def time_render(pdf_bytes, page_count, mode, workers, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        render_pages(pdf_bytes, page_count, mode=mode, workers=workers)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PDF page rasterization modes.")
+    parser.add_argument("pdf", help="Source PDF; its pages are repeated to reach each page count")
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 5, 15, 40])
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with open(args.pdf, 'rb') as file:
+        pdf_reader = PdfReader(file)
+        documents = {count: build_document(pdf_reader, count) for count in args.pages}
+
+    print(f"cpu_count={os.cpu_count()}")
+    print(f"{'pages':>6} {'mode':>10} {'workers':>8} {'seconds':>9} {'pages/s':>9}")
+    for count, pdf_bytes in documents.items():
+        for mode in args.modes:
+            # The sequential and single-poppler modes do not depend on the worker count.
+            worker_counts = [1] if mode in ("sequential", "document") else args.workers
+            for workers in worker_counts:
+                elapsed = time_render(pdf_bytes, count, mode, workers, args.repeat)
+                print(f"{count:>6} {mode:>10} {workers:>8} {elapsed:>9.3f} {count / elapsed:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
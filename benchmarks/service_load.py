@@ -0,0 +1,125 @@
+"""Load test for service.py against the local Messages API stand-in.
+
+Usage (from the repo root):
+    python -m benchmarks.corpus bench_corpus --pages 1 2 5
+    python -m benchmarks.service_load bench_corpus --concurrency 32 --duration 60 --latency 2
+
+Starts the stub API in this process and service.py as a child process pointed at
+it, then keeps --concurrency clients posting the corpus PDFs for --duration
+seconds. Reports orders per minute, orders per minute per core (service CPU time,
+poppler included, divided by wall time), latency percentiles and how many
+requests were refused with 429.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+import aiohttp
+from benchmarks.stub_api import load_responses, serve
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_ready(session, url, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with session.get(f"{url}/health") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            if time.monotonic() > deadline:
+                raise
+        await asyncio.sleep(0.2)
+
+
+async def client(session, url, orders, deadline, results):
+    while time.monotonic() < deadline:
+        pdf_path, email_text = next(orders)
+        form = aiohttp.FormData()
+        form.add_field("pdf", pdf_path.read_bytes(), filename=pdf_path.name, content_type="application/pdf")
+        if email_text:
+            form.add_field("email", email_text)
+        start = time.perf_counter()
+        async with session.post(f"{url}/orders?cache=0", data=form) as response:
+            await response.read()
+            results.append((response.status, time.perf_counter() - start))
+            if response.status == 429:
+                await asyncio.sleep(float(response.headers.get("Retry-After", "1")) / 10)
+
+
+async def run_load(url, orders, concurrency, duration):
+    results = []
+    timeout = aiohttp.ClientTimeout(total=600)
+    async with aiohttp.ClientSession(timeout=timeout, connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        await wait_ready(session, url)
+        start = time.perf_counter()
+        deadline = time.monotonic() + duration
+        await asyncio.gather(*(client(session, url, orders, deadline, results) for _ in range(concurrency)))
+        return results, time.perf_counter() - start
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))] if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure service.py throughput against the stub Messages API.")
+    parser.add_argument("corpus", help="Directory of PDFs (with expected XML) from benchmarks.corpus")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--latency", type=float, default=1.0, help="Stub API response latency in seconds")
+    parser.add_argument("--max-in-flight", type=int, default=16, help="Service in-flight limit")
+    args = parser.parse_args()
+
+    stub = serve(port=0, latency=args.latency, responses=load_responses(args.corpus))
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+
+    port = free_port()
+    env = dict(os.environ, ANTHROPIC_BASE_URL=f"http://127.0.0.1:{stub.server_address[1]}",
+               ANTHROPIC_API_KEY=os.environ.get("ANTHROPIC_API_KEY", "stub"), ORDER_CACHE_DISABLED="1",
+               METRICS_FILE="", TELEMETRY_LOG=os.devnull)
+    service = subprocess.Popen([sys.executable, "service.py", "--host", "127.0.0.1", "--port", str(port),
+                                "--max-in-flight", str(args.max_in_flight)],
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    corpus = Path(args.corpus)
+    orders = [(pdf_path, pdf_path.with_suffix(".txt").read_text(encoding="utf-8")
+               if pdf_path.with_suffix(".txt").exists() else None)
+              for pdf_path in sorted(corpus.glob("*.pdf"))]
+    try:
+        results, seconds = asyncio.run(run_load(f"http://127.0.0.1:{port}", itertools.cycle(orders),
+                                                args.concurrency, args.duration))
+    finally:
+        service.terminate()
+        service.wait()
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu_seconds = usage.ru_utime + usage.ru_stime
+
+    done = [seconds_taken for status, seconds_taken in results if status == 200]
+    refused = sum(1 for status, _ in results if status == 429)
+    failed = len(results) - len(done) - refused
+    per_minute = len(done) / seconds * 60
+    cores = cpu_seconds / seconds
+    print(f"{len(done)} orders in {seconds:.1f}s: {per_minute:.0f} orders/min, "
+          f"{per_minute / cores if cores else 0:.0f} orders/min per core ({cores:.2f} cores busy)")
+    print(f"Latency p50 {percentile(done, 0.5):.2f}s, p95 {percentile(done, 0.95):.2f}s, "
+          f"mean {statistics.mean(done) if done else 0:.2f}s")
+    print(f"Refused with 429: {refused}, other errors: {failed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Streamlit startup and rerun benchmark.
+
+Usage (from the repo root):
+    python -m benchmarks.startup --runs 5 --reruns 20
+
+Cold start: imports main.py in fresh interpreters and reports the import time and
+which heavy modules (anthropic, PIL, PyPDF2, ...) were loaded before the page
+could render. Rerun: drives main.py with Streamlit's AppTest, which re-executes the
+script the way a widget interaction does, and reports the time per rerun.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+HEAVY_MODULES = ("anthropic", "PIL", "PyPDF2", "requests", "utils.llm_utils", "utils.pdf_utils")
+
+CHILD = f"""
+import json, sys, time
+start = time.perf_counter()
+import main
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "loaded": [name for name in {HEAVY_MODULES!r} if name in sys.modules]}}))
+"""
+
+
+def cold_start(runs):
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", CHILD], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+
+def reruns(count):
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(str(Path("main.py").resolve()), default_timeout=60)
+    start = time.perf_counter()
+    app.run()
+    first = time.perf_counter() - start
+    times = []
+    for _ in range(count):
+        start = time.perf_counter()
+        app.run()
+        times.append(time.perf_counter() - start)
+    if app.exception:
+        raise RuntimeError(app.exception[0].message)
+    return first, times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure main.py import time and Streamlit rerun time.")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters for the cold-start measurement")
+    parser.add_argument("--reruns", type=int, default=20)
+    args = parser.parse_args()
+
+    results = cold_start(args.runs)
+    print(f"Cold import of main.py: median {statistics.median(r['seconds'] for r in results) * 1000:.0f} ms "
+          f"over {args.runs} runs")
+    print(f"Heavy modules loaded at startup: {', '.join(results[0]['loaded']) or 'none'}")
+
+    first, times = reruns(args.reruns)
+    print(f"First script run: {first * 1000:.0f} ms")
+    print(f"Rerun: median {statistics.median(times) * 1000:.1f} ms, "
+          f"max {max(times) * 1000:.1f} ms over {args.reruns} reruns")
+
+
+if __name__ == "__main__":
+    main()
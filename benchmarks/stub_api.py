@@ -0,0 +1,312 @@
+"""Local stand-in for the Anthropic Messages API.
+
+Point the app at it with ANTHROPIC_BASE_URL (the Anthropic client reads it):
+    python -m benchmarks.stub_api --port 8765 --latency 1.5 --tokens-per-second 80
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8765 streamlit run main.py
+
+With ``--responses DIR`` the stub answers with the ``*.xml`` file whose
+external_document_id occurs in the request (see benchmarks.corpus); otherwise
+it returns a built-in order. Both plain and streaming (SSE) requests are supported.
+
+Failures can be injected to exercise retries, hedging and continuation:
+--error-rate answers that share of requests with a 529 or 500 error, --slow-rate
+delays that share by --slow-latency seconds, and --max-output-tokens cuts answers
+off with stop_reason "max_tokens". An assistant prefill is honoured: the answer
+continues after it.
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+CANNED_XML = """<?xml version="1.0" standalone="yes"?>
+<XML_order documentsource="AIPDF" external_document_id="P0031006" supplier="COPACO">
+  <orderheader sender_id="XXXXXXXXXX" customer_ordernumber="P0031006" orderdate="01-07-2025" completedelivery="" requested_deliverydate="NVT" recipientsreference="Own use">
+    <Customer>
+      <customerid>111507</customerid>
+    </Customer>
+    <ShipTo>
+      <adress>
+        <name1>Voorbeeld BV</name1>
+        <street>Sacrèstraat 12</street>
+        <postalcode>1000</postalcode>
+        <city>Brussel</city>
+        <country>BE</country>
+      </adress>
+    </ShipTo>
+    <ordertext>
+      <textqualifier>ATT</textqualifier>
+      <text></text>
+    </ordertext>
+    <ordertext>
+      <textqualifier>CFD</textqualifier>
+      <text></text>
+    </ordertext>
+  </orderheader>
+  <orderline>
+    <linenumber>1</linenumber>
+    <item_id tag="MF">5706998852436</item_id>
+    <quantity unit="ST">2</quantity>
+    <deliverydate>NVT</deliverydate>
+    <price currency="EUR">2267.60</price>
+    <item_description>HPE Aruba 6300F 48P 1G Switch</item_description>
+    <orderlinetext>
+      <textqualifier>BID</textqualifier>
+      <text>NVT</text>
+    </orderlinetext>
+  </orderline>
+</XML_order>"""
+
+
+def estimate_tokens(block):
+    if isinstance(block, str):
+        return max(1, len(block) // 4)
+    if block.get("type") == "image":
+        # Base64 inflates the raw image by a third; use it as a rough size proxy.
+        return max(1, len(block["source"]["data"]) * 3 // 4 // 750)
+    return max(1, len(block.get("text", "")) // 4)
+
+
+def load_responses(directory):
+    responses = {}
+    for path in Path(directory).glob("*.xml"):
+        text = path.read_text(encoding="utf-8")
+        match = re.search(r'external_document_id="([^"]+)"', text)
+        if match:
+            responses[match.group(1)] = text
+    return responses
+
+
+def request_text(body):
+    parts = []
+    for message in body.get("messages", []):
+        content = message["content"]
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(block.get("text", "") for block in content if block.get("type") == "text")
+    return "\n".join(parts)
+
+
+def assistant_prefill(body):
+    messages = body.get("messages", [])
+    if not messages or messages[-1]["role"] != "assistant":
+        return ""
+    content = messages[-1]["content"]
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content if block.get("type") == "text")
+
+
+class StubState:
+
+    def __init__(self, response_text, latency, jitter=0.0, tokens_per_second=0.0, responses=None,
+                 error_rate=0.0, slow_rate=0.0, slow_latency=0.0, max_output_tokens=0):
+        self.response_text = response_text
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.responses = responses or {}
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.max_output_tokens = max_output_tokens
+        self.cached_prefixes = set()
+        self.lock = threading.Lock()
+
+    def pick_response(self, body):
+        if self.responses:
+            text = request_text(body)
+            for document_id, response_text in self.responses.items():
+                if document_id in text:
+                    return response_text
+        return self.response_text
+
+    def answer(self, body):
+        # Returns (text, stop_reason): the part after an assistant prefill, cut at max_tokens.
+        response_text = self.pick_response(body)
+        prefill = assistant_prefill(body)
+        if prefill and response_text.startswith(prefill):
+            response_text = response_text[len(prefill):]
+        # Off by default: chunk requests are answered with the whole document, which would
+        # not fit their max_tokens.
+        if self.max_output_tokens and len(response_text) > self.max_output_tokens * 4:
+            return response_text[:self.max_output_tokens * 4], "max_tokens"
+        return response_text, "end_turn"
+
+    def injected_error(self):
+        if self.error_rate and random.random() < self.error_rate:
+            return random.choice([(529, "overloaded_error", "Overloaded"), (500, "api_error", "Internal server error")])
+        return None
+
+    def wait(self):
+        latency = self.latency + random.uniform(-self.jitter, self.jitter)
+        if self.slow_rate and random.random() < self.slow_rate:
+            latency += self.slow_latency
+        time.sleep(max(0.0, latency))
+
+    def usage(self, body, response_text):
+        # Walk the prompt in API order (system, then message content) and treat
+        # everything up to the last cache_control marker as the cacheable prefix.
+        system = body.get("system") or []
+        if isinstance(system, str):
+            system = [{"type": "text", "text": system}]
+        blocks = list(system)
+        for message in body.get("messages", []):
+            content = message["content"]
+            blocks.extend([content] if isinstance(content, str) else content)
+
+        prefix_end = 0
+        for i, block in enumerate(blocks):
+            if isinstance(block, dict) and block.get("cache_control"):
+                prefix_end = i + 1
+
+        prefix_tokens = sum(estimate_tokens(block) for block in blocks[:prefix_end])
+        rest_tokens = sum(estimate_tokens(block) for block in blocks[prefix_end:])
+        creation = read = 0
+        if prefix_end:
+            digest = hashlib.sha256(json.dumps(blocks[:prefix_end], sort_keys=True).encode()).hexdigest()
+            with self.lock:
+                if digest in self.cached_prefixes:
+                    read = prefix_tokens
+                else:
+                    self.cached_prefixes.add(digest)
+                    creation = prefix_tokens
+        return {
+            "input_tokens": rest_tokens,
+            "output_tokens": max(1, len(response_text) // 4),
+            "cache_creation_input_tokens": creation,
+            "cache_read_input_tokens": read,
+        }
+
+
+def make_handler(state):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, payload):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def send_event(self, event, payload):
+            self.wfile.write(f"event: {event}\ndata: {json.dumps(payload)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        def do_POST(self):
+            if self.path.split("?")[0].rstrip("/") != "/v1/messages":
+                self.send_json(404, {"type": "error", "error": {"type": "not_found_error", "message": self.path}})
+                return
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            # Errors are returned before a stream starts, as the API does for overload.
+            failure = state.injected_error()
+            if failure:
+                status, error_type, text = failure
+                self.send_json(status, {"type": "error", "error": {"type": error_type, "message": text}})
+                return
+            response_text, stop_reason = state.answer(body)
+            usage = state.usage(body, response_text)
+            message = {
+                "id": f"msg_{uuid.uuid4().hex}",
+                "type": "message",
+                "role": "assistant",
+                "model": body.get("model"),
+                "content": [{"type": "text", "text": response_text}],
+                "stop_reason": stop_reason,
+                "stop_sequence": None,
+                "usage": usage,
+            }
+            if body.get("stream"):
+                try:
+                    self.stream_message(message, response_text)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client closed the stream, e.g. the losing request of a hedge
+            else:
+                state.wait()
+                if state.tokens_per_second:
+                    time.sleep(usage["output_tokens"] / state.tokens_per_second)
+                self.send_json(200, message)
+
+        def stream_message(self, message, response_text):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+
+            usage = message["usage"]
+            self.send_event("message_start", {"type": "message_start", "message": message | {
+                "content": [], "stop_reason": None, "usage": usage | {"output_tokens": 1}}})
+            # Like the API, headers and message_start come at once; the latency is before the text.
+            state.wait()
+            self.send_event("content_block_start", {"type": "content_block_start", "index": 0,
+                                                    "content_block": {"type": "text", "text": ""}})
+            chunk_size = 16  # roughly four tokens per delta
+            for start in range(0, len(response_text), chunk_size):
+                if state.tokens_per_second:
+                    time.sleep(chunk_size / 4 / state.tokens_per_second)
+                self.send_event("content_block_delta", {
+                    "type": "content_block_delta", "index": 0,
+                    "delta": {"type": "text_delta", "text": response_text[start:start + chunk_size]}})
+            self.send_event("content_block_stop", {"type": "content_block_stop", "index": 0})
+            self.send_event("message_delta", {"type": "message_delta",
+                                              "delta": {"stop_reason": message["stop_reason"], "stop_sequence": None},
+                                              "usage": {"output_tokens": usage["output_tokens"]}})
+            self.send_event("message_stop", {"type": "message_stop"})
+
+    return Handler
+
+
+def serve(host="127.0.0.1", port=8765, response_text=CANNED_XML, latency=0.0, jitter=0.0,
+          tokens_per_second=0.0, responses=None, error_rate=0.0, slow_rate=0.0, slow_latency=0.0,
+          max_output_tokens=0):
+    state = StubState(response_text, latency, jitter, tokens_per_second, responses,
+                      error_rate, slow_rate, slow_latency, max_output_tokens)
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the Anthropic Messages API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before the first token")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform +/- jitter on the latency, in seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="Simulated generation speed (0 = instant)")
+    parser.add_argument("--response", help="File with the XML to return instead of the built-in order")
+    parser.add_argument("--responses", help="Directory of expected XML files, matched by external_document_id")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with a 529/500")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Share of requests delayed by --slow-latency")
+    parser.add_argument("--slow-latency", type=float, default=0.0, help="Extra seconds for slow requests")
+    parser.add_argument("--max-output-tokens", type=int, default=0,
+                        help="Cut answers off at this many tokens (0 = never)")
+    args = parser.parse_args()
+
+    response_text = CANNED_XML
+    if args.response:
+        with open(args.response, encoding="utf-8") as file:
+            response_text = file.read()
+    responses = load_responses(args.responses) if args.responses else None
+
+    server = serve(args.host, args.port, response_text, args.latency, args.jitter,
+                   args.tokens_per_second, responses, args.error_rate, args.slow_rate, args.slow_latency,
+                   args.max_output_tokens)
+    print(f"Stub Messages API listening on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Order ingestion from a mailbox.
+
+Usage:
+    python mail_ingest.py ~/Maildir/.Orders --output out/ --concurrency 4 --watch 30
+    python mail_ingest.py exported/ --output out/
+
+The source is a maildir, an mbox file, an ``.eml`` file or a directory of ``.eml``
+and ``.mbox`` files. Every PDF attachment of a message is processed as an order,
+with the subject and plain-text body as its email text. Message-IDs are recorded
+in MAIL_DB, so messages that were processed before are skipped on the next scan;
+failed ones are retried up to MAIL_MAX_ATTEMPTS times in all. With --watch the source is rescanned every N seconds.
+"""
+import argparse
+import hashlib
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from utils.llm_utils import process
+from utils.mail_utils import MailStore, iter_message_files, order_parts, read_message, read_message_id
+from utils.xml_utils import save_xml
+
+
+def output_path(output_dir, message_id, index, filename):
+    # The Message-ID hash keeps attachments with the same name in different mails apart.
+    digest = hashlib.sha256(message_id.encode("utf-8")).hexdigest()[:8]
+    return Path(output_dir) / f"{Path(filename).stem}_{digest}_{index}_processed.xml"
+
+
+def process_message(message, message_id, label, output_dir, store):
+    pdfs, email_text = order_parts(message)
+    if not pdfs:
+        print(f"{label}: no PDF attachment, skipped")
+        store.mark(message_id, label, "done")
+        return 0
+
+    try:
+        for index, (filename, pdf_data) in enumerate(pdfs, start=1):
+            target = output_path(output_dir, message_id, index, filename)
+            # Attachments finished before a failure are not redone when the message is retried.
+            if target.exists():
+                continue
+            xml_output = process(pdf_data, email_text)
+            tmp_path = target.with_suffix(".xml.tmp")
+            save_xml(xml_output, str(tmp_path))
+            os.replace(tmp_path, target)
+    except Exception as e:
+        print(f"❌ {label} ({filename}): {e}")
+        attempts = store.mark(message_id, label, "failed", len(pdfs), str(e))
+        if attempts >= store.max_attempts:
+            print(f"{label}: giving up after {attempts} failed attempts")
+        raise
+    print(f"✅ {label}: {len(pdfs)} order{'s' if len(pdfs) > 1 else ''}")
+    store.mark(message_id, label, "done", len(pdfs))
+    return len(pdfs)
+
+
+def scan(source, output_dir, store, executor, slots):
+    # Messages are parsed on this thread and processed on the pool; slots bounds how
+    # many parsed messages (and their attachments) are held in memory at once.
+    futures, skipped, given_up = [], 0, 0
+    for label, open_message in iter_message_files(source):
+        with open_message() as file:
+            message_id = read_message_id(file)
+        reason = store.skip_reason(message_id)
+        if reason is not None:
+            skipped += reason == "done"
+            given_up += reason == "given up"
+            continue
+        slots.acquire()
+        try:
+            message = read_message(open_message)
+            future = executor.submit(process_message, message, message_id, label, output_dir, store)
+        except BaseException:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        futures.append(future)
+
+    failures = sum(1 for future in futures if future.exception() is not None)
+    orders = sum(future.result() for future in futures if future.exception() is None)
+    print(f"Scan done: {len(futures)} new messages ({orders} orders, {failures} failed), {skipped} already processed"
+          + (f", {given_up} given up after {store.max_attempts} failed attempts" if given_up else ""))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process the PDF attachments of a maildir, mbox or .eml files.")
+    parser.add_argument("source", help="Maildir, mbox file, .eml file or directory of .eml/.mbox files")
+    parser.add_argument("--output", default="output", help="Directory for the generated XML files")
+    parser.add_argument("--concurrency", type=int, default=4, help="Messages processed at once")
+    parser.add_argument("--watch", type=float, default=0, help="Rescan the source every N seconds")
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    store = MailStore()
+    slots = threading.BoundedSemaphore(args.concurrency * 2)
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        while True:
+            failures = scan(args.source, args.output, store, executor, slots)
+            if not args.watch:
+                break
+            time.sleep(args.watch)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,119 @@
 import streamlit as st
-import tempfile
-import os
-from utils.streamlit_utils import load_local_image
-from utils.llm_utils import process
-from utils.xml_utils import validate_xml
+import time
+from utils.streamlit_utils import load_local_image, show_timing_breakdown
+from utils.job_utils import JobQueue
+from utils.cache_utils import result_cache
+from utils.telemetry_utils import start_metrics_server
+from utils.xml_utils import validate_xml, zip_xml_files
+
+
+@st.cache_resource
+def metrics_server():
+    # One /metrics endpoint per server process (only when METRICS_PORT is set).
+    return start_metrics_server()
+
+
+@st.cache_resource
+def job_queue():
+    # Shared by all sessions; the worker threads live as long as the server process.
+    return JobQueue().start()
+
+
+def job_rows(jobs):
+    rows = []
+    for job in jobs:
+        if job["status"] == "queued":
+            status = f"⏳ queued (#{job['position']})"
+        elif job["status"] == "running":
+            status = f"⚙️ running ({time.time() - job['started']:.0f}s)"
+        elif job["status"] == "done":
+            status = "✅ done"
+        else:
+            status = "❌ failed"
+        finished = job["status"] in ("done", "failed")
+        rows.append({
+            "File": job["filename"],
+            "Status": status,
+            "Seconds": round(job["finished"] - job["created"], 1) if finished else None,
+            "Valid XML": validate_xml(job["result"]) if job["status"] == "done" else None,
+            "Error": job["error"],
+        })
+    return rows
+
+
+def load_jobs(job_ids):
+    return [job for job in (job_queue().get(job_id) for job_id in job_ids) if job is not None]
+
+
+@st.fragment(run_every=2)
+def show_job_status(job_ids, show_partial):
+    jobs = load_jobs(job_ids)
+    if all(job["status"] in ("done", "failed") for job in jobs):
+        st.rerun()
+
+    st.info("⚙️ Processing orders... This page updates automatically.")
+    st.dataframe(job_rows(jobs), hide_index=True)
+    if show_partial:
+        for job in jobs:
+            if job["status"] == "running" and job["result"]:
+                with st.expander(f"Live output: {job['filename']}", expanded=len(jobs) == 1):
+                    st.code(job["result"], language="xml")
+
+
+def output_name(filename):
+    return f"{(filename or 'order').removesuffix('.pdf')}_processed.xml"
+
+
+def show_results(jobs):
+    done = [job for job in jobs if job["status"] == "done"]
+    failed = [job for job in jobs if job["status"] == "failed"]
+    if done:
+        st.success(f"✅ {len(done)} of {len(jobs)} orders processed successfully!")
+    for job in failed:
+        st.error(f"❌ Error during order processing of {job['filename']}: {job['error']}")
+
+    st.subheader("📊 Order Status")
+    st.dataframe(job_rows(jobs), hide_index=True)
+
+    if not done:
+        return
+
+    st.subheader("📄 Generated XML Output")
+    for job in done:
+        with st.expander(f"View XML Content: {job['filename']}", expanded=False):
+            st.text_area(
+                "XML Output",
+                value=job["result"],
+                height=300,
+                label_visibility="collapsed",
+                key=f"xml_{job['id']}"
+            )
+            st.download_button(
+                label="📥 Download XML File",
+                data=job["result"],
+                file_name=output_name(job["filename"]),
+                mime="application/xml",
+                help="Download the processed XML file",
+                key=f"download_{job['id']}"
+            )
+
+    st.subheader("💾 Download Results")
+    if len(done) == 1:
+        st.download_button(
+            label="📥 Download XML File",
+            data=done[0]["result"],
+            file_name=output_name(done[0]["filename"]),
+            mime="application/xml",
+            help="Download the processed XML file"
+        )
+    else:
+        st.download_button(
+            label=f"📦 Download all {len(done)} XML files (zip)",
+            data=zip_xml_files([(output_name(job["filename"]), job["result"]) for job in done]),
+            file_name="processed_orders.zip",
+            mime="application/zip",
+            help="Download every generated XML file in one zip archive"
+        )
 
 
 def run_app():
@@ -11,16 +121,16 @@ def run_app():
     copaco_path = "icons/copaco.jpg"
     st.set_page_config(page_title="COPACO PoC", page_icon=load_local_image(copaco_path))
     st.title("📄 PDF & Email Processor")
-    st.markdown("Upload your PDF file and optionally provide the email text to process them together.")
+    st.markdown("Upload your PDF files and optionally provide the email text for each of them to process them together.")
     with st.expander("ℹ️ How to use this app"):
         st.markdown("""
         **Steps to process your order:**
 
-        1. **Upload PDF File** (Required): Click on the PDF upload area and select your order PDF file
-        2. **Add Email Text** (Optional): Copy and paste the email text that accompanied the PDF order
-        3. **Process Order**: Click the "Process Order" button to start processing
-        4. **View Results**: Once processing is complete, you can view the generated XML content
-        5. **Download**: Use the download button to save the processed XML file to your computer
+        1. **Upload PDF Files** (Required): Click on the PDF upload area and select one or more order PDF files
+        2. **Add Email Text** (Optional): For each PDF, copy and paste the email text that accompanied the order
+        3. **Process Order**: Click the "Process Order" button to start processing; all files are processed concurrently
+        4. **View Results**: The status table shows the progress and XML validity of every file; once complete, you can view the generated XML content
+        5. **Download**: Download each processed XML file, or all of them at once as a zip archive
 
         **⚠️ The output quality depends entirely on the content of your PDF and email text.**
 
@@ -51,89 +161,79 @@ def run_app():
         </div>
         """, unsafe_allow_html=True)
 
-    if 'processed_xml' not in st.session_state:
-        st.session_state.processed_xml = None
-    if 'processing_complete' not in st.session_state:
-        st.session_state.processing_complete = False
-    if 'pdf_filename' not in st.session_state:
-        st.session_state.pdf_filename = None
+    if 'job_ids' not in st.session_state:
+        # Job ids are also kept in the URL, so a reconnecting browser picks its jobs back up.
+        st.session_state.job_ids = st.query_params.get_all("job")
+    metrics_server()
 
-    st.sidebar.subheader("📎 PDF File (Required)")
-    pdf_file = st.sidebar.file_uploader(
-        "Choose a PDF file",
+    st.sidebar.subheader("📎 PDF Files (Required)")
+    pdf_files = st.sidebar.file_uploader(
+        "Choose PDF files",
         type=['pdf'],
-        help="Upload the PDF order file you want to process"
+        accept_multiple_files=True,
+        help="Upload one or more PDF order files you want to process"
     )
 
-    if pdf_file is not None:
-        st.session_state.pdf_filename = pdf_file.name.removesuffix(".pdf")
-        st.sidebar.success(f"✅ PDF uploaded: {pdf_file.name}")
+    if pdf_files:
+        st.sidebar.success(f"✅ {len(pdf_files)} PDF file{'s' if len(pdf_files) > 1 else ''} uploaded")
 
     st.sidebar.subheader("📧 Email Text (Optional)")
-    email_text = st.sidebar.text_area(
-        "Paste email content here",
-        height=200,
-        placeholder="Example:\nFW: Inkooporder P0031006 / Own use //16971720\n\nBeste Copaco,\n\nHierbij onze order...\n\nKlantnummer: 111507\nReferentie: Own use",
-        help="Copy and paste the email text that accompanied this PDF order."
-    )
+    email_texts = {}
+    for pdf_file in pdf_files or [None]:
+        email_texts[pdf_file.file_id if pdf_file else None] = st.sidebar.text_area(
+            f"Email for {pdf_file.name}" if pdf_file else "Paste email content here",
+            height=200 if len(pdf_files) <= 1 else 120,
+            placeholder="Example:\nFW: Inkooporder P0031006 / Own use //16971720\n\nBeste Copaco,\n\nHierbij onze order...\n\nKlantnummer: 111507\nReferentie: Own use",
+            help="Copy and paste the email text that accompanied this PDF order.",
+            key=f"email_{pdf_file.file_id}" if pdf_file else "email_text"
+        )
 
-    if email_text and email_text.strip():
-        st.sidebar.success(f"✅ Email text provided")
+    provided = sum(1 for text in email_texts.values() if text and text.strip())
+    if provided:
+        st.sidebar.success(f"✅ Email text provided" + (f" for {provided} files" if len(pdf_files) > 1 else ""))
+
+    st.sidebar.subheader("⚙️ Options")
+    use_cache = st.sidebar.checkbox(
+        "Reuse cached results",
+        value=True,
+        help="Return the stored XML when the same PDF and email text were processed before. Untick to force a new run."
+    )
+    stream_output = st.sidebar.checkbox(
+        "Stream output",
+        value=True,
+        help="Show the XML while it is generated. Output that is not valid XML is always stopped early."
+    )
+    cache_stats = result_cache.stats()
+    st.sidebar.caption(f"Cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses")
 
-    process_disabled = pdf_file is None
+    process_disabled = not pdf_files
 
     if st.button(
-            "🚀 Process Order",
+            "🚀 Process Orders" if len(pdf_files) > 1 else "🚀 Process Order",
             disabled=process_disabled,
-            help="Process the uploaded PDF and email text" if not process_disabled else "Upload a PDF file first"
+            help="Process the uploaded PDFs and email texts" if not process_disabled else "Upload a PDF file first"
     ):
-        if pdf_file is not None:
-            with st.spinner("Processing order... This may take a moment."):
-                try:
-                    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_pdf:
-                        tmp_pdf.write(pdf_file.getvalue())
-                        pdf_path = tmp_pdf.name
-
-                    email_content = email_text.strip() if email_text else None
-                    final_xml = process(pdf_path, email_content)
-
-                    st.session_state.processed_xml = final_xml
-                    st.session_state.processing_complete = True
-
-                    os.unlink(pdf_path)
-
-                    st.success("✅ Order processing completed successfully!")
-
-                except Exception as e:
-                    st.error(f"❌ Error during order processing: {str(e)}")
-                    st.session_state.processing_complete = False
-
-    if st.session_state.processing_complete:
-        if st.session_state.processed_xml:
-            is_valid = validate_xml(st.session_state.processed_xml)
-            if is_valid:
-                st.success("✅ Generated XML is valid!")
-            else:
-                st.warning("⚠️ Warning: Generated XML may not be well-formed")
-
-        st.subheader("📄 Generated XML Output")
-        with st.expander("View XML Content", expanded=False):
-            st.text_area(
-                "XML Output",
-                value=st.session_state.processed_xml,
-                height=300,
-                label_visibility="collapsed"
+        # Every file becomes its own job; the queue's worker pool bounds how many run at once.
+        st.session_state.job_ids = [
+            job_queue().enqueue(
+                pdf_file.getvalue(),
+                email_texts[pdf_file.file_id].strip() or None,
+                pdf_file.name,
+                use_cache=use_cache
             )
-
-        st.subheader("💾 Download Results")
-        download_file_name = f"{st.session_state.pdf_filename}_processed.xml"
-        st.download_button(
-            label="📥 Download XML File",
-            data=st.session_state.processed_xml,
-            file_name=download_file_name,
-            mime="application/xml",
-            help="Download the processed XML file"
-        )
+            for pdf_file in pdf_files
+        ]
+        st.query_params["job"] = st.session_state.job_ids
+
+    if st.session_state.job_ids:
+        jobs = load_jobs(st.session_state.job_ids)
+        if any(job["status"] in ("queued", "running") for job in jobs):
+            show_job_status(st.session_state.job_ids, stream_output)
+        elif jobs:
+            show_results(jobs)
+            traces = [job for job in jobs if job["trace"]]
+            if traces:
+                show_timing_breakdown(max(traces, key=lambda job: job["finished"])["trace"])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,179 @@
+"""HTTP order-ingestion service.
+
+Usage:
+    python service.py --port 8080
+    curl -F pdf=@order.pdf -F email="$(cat order.txt)" http://127.0.0.1:8080/orders
+    curl -F pdf=@order.pdf "http://127.0.0.1:8080/orders?mode=job"
+
+POST /orders takes a multipart upload with a ``pdf`` file and an optional ``email``
+text field. By default the order is processed while the request waits and the
+``<XML_order>`` document is returned; with ``mode=job`` it is queued in the job
+queue shared with the Streamlit app and a job reference is returned, to be polled
+at GET /orders/<job_id>. At most SERVICE_MAX_IN_FLIGHT orders are processed at once;
+further requests are refused with 429 and a Retry-After header.
+"""
+import argparse
+import asyncio
+import os
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
+from anthropic import APIError, APIStatusError
+from PyPDF2.errors import PdfReadError
+from utils.job_utils import JobQueue
+from utils.llm_utils import aprocess, close_async_client, get_async_client
+from utils.telemetry_utils import metrics, trace_order
+
+
+SERVICE_MAX_IN_FLIGHT = int(os.getenv("SERVICE_MAX_IN_FLIGHT", "16"))
+SERVICE_MAX_QUEUED = int(os.getenv("SERVICE_MAX_QUEUED", "200"))
+SERVICE_WORKERS = int(os.getenv("SERVICE_WORKERS", str(os.cpu_count() or 4)))
+SERVICE_MAX_UPLOAD_MB = int(os.getenv("SERVICE_MAX_UPLOAD_MB", "50"))
+RETRY_AFTER_SECONDS = 5
+OVERLOADED_STATUS_CODES = (429, 529)
+
+
+class Service:
+
+    def __init__(self, max_in_flight=SERVICE_MAX_IN_FLIGHT, jobs=None):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.jobs = jobs
+
+    def job_queue(self):
+        # The queue and its worker threads are only started once a job is submitted.
+        if self.jobs is None:
+            self.jobs = JobQueue().start()
+        return self.jobs
+
+
+SERVICE = web.AppKey("service", Service)
+
+
+def error(status, message, **headers):
+    metrics.inc("service_responses_total", help_text="HTTP responses by status", status=str(status))
+    return web.json_response({"error": message}, status=status, headers=headers)
+
+
+async def read_upload(request):
+    # Returns (pdf_bytes, email_text, filename); pdf_bytes is None when no file was sent.
+    pdf_data, email_text, filename = None, None, None
+    reader = await request.multipart()
+    async for part in reader:
+        if part.name == "pdf":
+            filename = part.filename
+            pdf_data = await part.read()
+        elif part.name == "email":
+            email_text = (await part.text()).strip() or None
+    return pdf_data, email_text, filename
+
+
+async def create_order(request):
+    service = request.app[SERVICE]
+    # Checked before the upload is read, so a refused request costs next to nothing.
+    if service.in_flight >= service.max_in_flight:
+        metrics.inc("service_rejected_total", help_text="Orders refused because the service was at capacity")
+        return error(429, "Too many orders in flight", **{"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+    service.in_flight += 1
+    try:
+        try:
+            pdf_data, email_text, filename = await read_upload(request)
+        except (ValueError, AssertionError) as e:
+            return error(400, f"Expected a multipart/form-data upload: {e}")
+        if not pdf_data:
+            return error(400, "Missing 'pdf' file field")
+        use_cache = request.query.get("cache", "1") not in ("0", "false", "no")
+
+        if request.query.get("mode") == "job":
+            jobs = service.job_queue()
+            if await asyncio.to_thread(jobs.depth) >= SERVICE_MAX_QUEUED:
+                metrics.inc("service_rejected_total", help_text="Orders refused because the service was at capacity")
+                return error(429, "Job queue is full", **{"Retry-After": str(RETRY_AFTER_SECONDS * 6)})
+            job_id = await asyncio.to_thread(jobs.enqueue, pdf_data, email_text, filename, use_cache)
+            metrics.inc("service_responses_total", help_text="HTTP responses by status", status="202")
+            return web.json_response({"job_id": job_id, "status": "queued", "url": f"/orders/{job_id}"},
+                                     status=202)
+
+        # Errors are caught outside the trace so that it is emitted with the error recorded.
+        try:
+            with trace_order(entry="service", filename=filename) as trace:
+                xml_output = await aprocess(pdf_data, email_text, use_cache)
+        except PdfReadError as e:
+            return error(400, f"Could not read the PDF: {e}")
+        except APIStatusError as e:
+            if e.status_code in OVERLOADED_STATUS_CODES:
+                return error(503, "Messages API is overloaded", **{"Retry-After": str(RETRY_AFTER_SECONDS)})
+            return error(502, f"Messages API error: {e}")
+        except APIError as e:
+            return error(502, f"Messages API error: {e}")
+        except TimeoutError as e:
+            return error(504, f"Order not processed within its deadline: {e}")
+        except (ValueError, ET.ParseError) as e:
+            return error(422, str(e))
+        metrics.inc("service_responses_total", help_text="HTTP responses by status", status="200")
+        return web.Response(text=xml_output, content_type="application/xml", headers={"X-Trace-Id": trace.trace_id})
+    finally:
+        service.in_flight -= 1
+
+
+async def get_order(request):
+    job = await asyncio.to_thread(request.app[SERVICE].job_queue().get, request.match_info["job_id"])
+    if job is None:
+        return error(404, "Unknown job")
+    if job["status"] == "done":
+        return web.Response(text=job["result"], content_type="application/xml")
+    if job["status"] == "failed":
+        return web.json_response({"job_id": job["id"], "status": "failed", "error": job["error"]}, status=422)
+    return web.json_response({"job_id": job["id"], "status": job["status"], "position": job.get("position")},
+                             status=202)
+
+
+async def health(request):
+    service = request.app[SERVICE]
+    return web.json_response({"in_flight": service.in_flight, "max_in_flight": service.max_in_flight})
+
+
+async def metrics_page(request):
+    return web.Response(text=metrics.render(), content_type="text/plain")
+
+
+async def on_startup(app):
+    # PDF parsing and rasterization run through asyncio.to_thread, i.e. in this pool.
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=SERVICE_WORKERS, thread_name_prefix="pdf-worker"))
+    get_async_client()
+
+
+async def on_cleanup(app):
+    await close_async_client()
+    if app[SERVICE].jobs is not None:
+        app[SERVICE].jobs.stop()
+
+
+def create_app(max_in_flight=SERVICE_MAX_IN_FLIGHT):
+    app = web.Application(client_max_size=SERVICE_MAX_UPLOAD_MB * 1024 * 1024)
+    app[SERVICE] = Service(max_in_flight)
+    app.add_routes([
+        web.post("/orders", create_order),
+        web.get("/orders/{job_id}", get_order),
+        web.get("/health", health),
+        web.get("/metrics", metrics_page),
+    ])
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the order pipeline over HTTP.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-in-flight", type=int, default=SERVICE_MAX_IN_FLIGHT,
+                        help="Orders processed at once before requests are refused with 429")
+    args = parser.parse_args()
+    web.run_app(create_app(args.max_in_flight), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
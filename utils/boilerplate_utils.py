@@ -0,0 +1,132 @@
+import hashlib
+import os
+import re
+import time
+from utils.chunk_utils import ROW
+from utils.common_utils import connect_sqlite, env_flag
+
+
+BOILERPLATE_FILTER = env_flag("BOILERPLATE_FILTER", True)
+BOILERPLATE_INDEX = os.getenv("BOILERPLATE_INDEX", "boilerplate.sqlite3")
+BOILERPLATE_MIN_DOCUMENTS = int(os.getenv("BOILERPLATE_MIN_DOCUMENTS", "3"))
+MIN_BOILERPLATE_CHARS = 800
+
+# Headings of terms-and-conditions style pages; only the top of a page is searched.
+HEADING = re.compile(
+    r"algemene\s+(?:verkoop|leverings|inkoop|betalings)?-?\s*voorwaarden|terms\s+(?:and|&)\s+conditions"
+    r"|general\s+(?:terms|conditions)|conditions\s+g[ée]n[ée]rales|allgemeine\s+gesch[äa]ftsbedingungen"
+    r"|privacy\s*(?:statement|policy|verklaring)",
+    re.IGNORECASE,
+)
+HEADING_CHARS = 400
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sightings (
+    fingerprint TEXT NOT NULL,
+    document TEXT NOT NULL,
+    sample TEXT,
+    seen REAL NOT NULL,
+    PRIMARY KEY (fingerprint, document)
+);
+"""
+
+
+def page_fingerprint(text):
+    # Letters only, so page numbers, dates and extraction whitespace do not change the hash.
+    normalized = " ".join(re.sub(r"[^\w\s]|\d|_", " ", text.lower()).split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:32]
+
+
+def is_prose(text):
+    # Long text without a single amount-bearing row, i.e. nothing that could be an order line.
+    return len("".join(text.split())) >= MIN_BOILERPLATE_CHARS and not ROW.search(text)
+
+
+class BoilerplateIndex:
+    # Pages guessed to be boilerplate, with the documents they were seen in. A guess only
+    # becomes a known page once it was made on BOILERPLATE_MIN_DOCUMENTS different
+    # documents, so one wrong guess does not drop that page from every later order.
+
+    def __init__(self, path=BOILERPLATE_INDEX, min_documents=BOILERPLATE_MIN_DOCUMENTS):
+        self.path = path
+        self.min_documents = min_documents
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+
+    def _connect(self):
+        return connect_sqlite(self.path)
+
+    def known(self, fingerprints):
+        fingerprints = list(fingerprints)
+        if not fingerprints:
+            return set()
+        with self._connect() as connection:
+            rows = connection.execute(
+                f"SELECT fingerprint FROM sightings WHERE fingerprint IN ({', '.join('?' * len(fingerprints))}) "
+                "GROUP BY fingerprint HAVING COUNT(*) >= ?", (*fingerprints, self.min_documents)).fetchall()
+        return {row[0] for row in rows}
+
+    def add(self, document, pages):
+        # pages: (fingerprint, text) pairs guessed on one document; a document counts once.
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO sightings (fingerprint, document, sample, seen) VALUES (?, ?, ?, ?)",
+                [(fingerprint, document, " ".join(text.split())[:80], time.time()) for fingerprint, text in pages])
+
+    def __len__(self):
+        with self._connect() as connection:
+            return connection.execute(
+                "SELECT COUNT(*) FROM (SELECT fingerprint FROM sightings GROUP BY fingerprint HAVING COUNT(*) >= ?)",
+                (self.min_documents,)).fetchone()[0]
+
+
+boilerplate_index = None
+
+
+def get_boilerplate_index():
+    global boilerplate_index
+    if boilerplate_index is None:
+        boilerplate_index = BoilerplateIndex()
+    return boilerplate_index
+
+
+def filter_pages(page_texts, index=None):
+    # Returns (page_texts, skipped): dropped pages become None and skipped lists
+    # (page_number, reason) pairs. The first page always holds the order and is kept.
+    # A page is boilerplate when it is known to the index, when it is prose under a
+    # terms-and-conditions heading, or when it is prose continuing such a page; the
+    # last two are recorded in the index, which learns them once several documents agree.
+    if not BOILERPLATE_FILTER:
+        return page_texts, []
+
+    if index is None:
+        index = get_boilerplate_index()
+    fingerprints = [page_fingerprint(text) if text and page_num > 1 else None
+                    for page_num, text in enumerate(page_texts, start=1)]
+    known = index.known(fingerprint for fingerprint in fingerprints if fingerprint)
+    kept, skipped, guessed = list(page_texts), [], []
+    previous = False
+    for page_num, (text, fingerprint) in enumerate(zip(page_texts, fingerprints), start=1):
+        reason = None
+        if fingerprint is None:
+            pass
+        elif fingerprint in known:
+            reason = "known"
+        elif is_prose(text) and HEADING.search(text[:HEADING_CHARS]):
+            reason = "heading"
+        elif is_prose(text) and previous:
+            reason = "continuation"
+
+        previous = reason is not None
+        if reason:
+            kept[page_num - 1] = None
+            skipped.append((page_num, reason))
+            if reason != "known":
+                guessed.append((fingerprint, text))
+
+    if guessed:
+        # The document is identified by its pages, so processing it again does not count twice.
+        document = hashlib.sha256(" ".join(fingerprint or page_fingerprint(text or "")
+                                           for fingerprint, text in zip(fingerprints, page_texts)).encode()).hexdigest()[:32]
+        index.add(document, guessed)
+    return kept, skipped
@@ -0,0 +1,107 @@
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+from utils.common_utils import env_flag
+
+
+CACHE_DIR = os.getenv("ORDER_CACHE_DIR", ".order_cache")
+CACHE_MAX_BYTES = int(os.getenv("ORDER_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+CACHE_MAX_AGE = int(os.getenv("ORDER_CACHE_MAX_AGE", str(30 * 24 * 3600)))
+CACHE_ENABLED = not env_flag("ORDER_CACHE_DISABLED")
+
+
+def normalize_email_text(email_text):
+    if not email_text:
+        return ""
+    lines = (" ".join(line.split()) for line in email_text.strip().splitlines())
+    return "\n".join(lines)
+
+
+def cache_key(pdf_data, email_text, prompt, settings) -> str:
+    # settings describes everything besides the input that shapes a result (models,
+    # routing, post-processing, catalog), so changing any of it misses the old entries.
+    digest = hashlib.sha256()
+    for part in (pdf_data, normalize_email_text(email_text).encode("utf-8"),
+                 prompt.encode("utf-8"), settings.encode("utf-8")):
+        # Length-prefix every part so that field boundaries cannot collide.
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    # One file per entry; the file mtime doubles as the last-access time for LRU eviction.
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, max_age=CACHE_MAX_AGE):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return self.directory / key[:2] / f"{key}.xml"
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if time.time() - path.stat().st_mtime > self.max_age:
+                path.unlink(missing_ok=True)
+                raise FileNotFoundError(path)
+            value = path.read_text(encoding="utf-8")
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_text(value, encoding="utf-8")
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        now = time.time()
+        entries = []
+        for path in self.directory.glob("*/*.xml"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime > self.max_age:
+                path.unlink(missing_ok=True)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def clear(self):
+        for path in self.directory.glob("*/*.xml"):
+            path.unlink(missing_ok=True)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+result_cache = ResultCache()
@@ -0,0 +1,307 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from utils.common_utils import connect_sqlite, env_flag
+from utils.schema_utils import serialize
+from utils.xml_utils import detect_xml_encoding
+
+
+CATALOG_DIR = os.getenv("CATALOG_DIR", "catalogs")
+CATALOG_INDEX = os.getenv("CATALOG_INDEX", "catalog.sqlite3")
+CATALOG_ENRICH = env_flag("CATALOG_ENRICH", True)
+CATALOG_REFRESH_SECONDS = 60  # catalog files are re-checked for changes at most this often
+INDEX_VERSION = 4  # bumped when the stored rows change; an older index is rebuilt
+
+# Supplier feeds name their fields differently; a record is any element with an EAN or SKU
+# among its leaf children or attributes (matched on lower-case local names).
+EAN_FIELDS = {"ean", "ean13", "ean_code", "eancode", "gtin", "barcode"}
+SKU_FIELDS = {"sku", "mpn", "manufacturer_sku", "manufacturerpartnumber", "partnumber", "part_number",
+              "vendor_part_number", "vpn", "artikelnummer", "productcode", "product_code", "item_id"}
+DESCRIPTION_FIELDS = {"description", "item_description", "omschrijving", "name", "productname", "title",
+                      "short_description"}
+PRICE_FIELDS = {"price", "prijs", "unit_price", "unitprice", "net_price", "nettoprijs"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    records INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS products (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    file TEXT NOT NULL,
+    ean TEXT,
+    sku TEXT,
+    description TEXT,
+    price TEXT,
+    PRIMARY KEY (kind, key, file)
+);
+CREATE INDEX IF NOT EXISTS products_file ON products (file);
+"""
+
+
+def local_name(tag):
+    return tag.rpartition("}")[2].lower()
+
+
+def normalize_ean(value):
+    # GTIN-14, EAN-13 and UPC-A spellings of one code differ only in leading zeros. Only
+    # digits (spaces at most) are an EAN; the digits of a SKU like "HP-8765-4321" are not.
+    digits = re.sub(r"\s+", "", value or "")
+    return digits.lstrip("0") if re.fullmatch(r"[0-9]{8,14}", digits) else None
+
+
+def normalize_sku(value):
+    sku = re.sub(r"\s+", "", value or "").upper()
+    return sku or None
+
+
+def normalize_description(value):
+    # Case, spacing and accents vary between the PDF text and the feed.
+    value = unicodedata.normalize("NFKD", " ".join((value or "").split()).lower())
+    return "".join(char for char in value if not unicodedata.combining(char)) or None
+
+
+def normalize_price(value):
+    value = re.sub(r"[^\d.,-]", "", value or "")
+    if "," in value:
+        value = value.replace(".", "").replace(",", ".")
+    try:
+        return f"{float(value):.2f}"
+    except ValueError:
+        return None
+
+
+def same_product(first, second):
+    # first and second are (ean, sku, ...) rows. A description row without codes was
+    # already ambiguous within its file; rows that share no code cannot be told apart.
+    codes = [(normalize(a), normalize(b)) for a, b, normalize in
+             ((first[0], second[0], normalize_ean), (first[1], second[1], normalize_sku)) if a and b]
+    return bool(codes) and all(a == b for a, b in codes)
+
+
+def record_fields(element):
+    fields = {local_name(name): value for name, value in element.attrib.items()}
+    for child in element:
+        if len(child) == 0 and child.text and child.text.strip():
+            fields.setdefault(local_name(child.tag), child.text.strip())
+
+    def first(names):
+        return next((fields[name] for name in names if name in fields), None)
+
+    # The codes are kept as the catalog spells them (an EAN's leading zeros are part of
+    # it); normalize_ean/normalize_sku only derive the lookup keys.
+    ean, sku = first(EAN_FIELDS), first(SKU_FIELDS)
+    ean = re.sub(r"\s+", "", ean) if normalize_ean(ean) else None
+    sku = sku if normalize_sku(sku) else None
+    if ean is None and sku is None:
+        return None
+    return {"ean": ean, "sku": sku, "description": first(DESCRIPTION_FIELDS), "price": normalize_price(first(PRICE_FIELDS))}
+
+
+def iter_catalog(path):
+    # Streams the records of one catalog file. The encoding is taken once from the BOM or
+    # XML declaration; each record is detached from its parent when done, so memory stays
+    # bounded by the nesting depth rather than the file size.
+    with open(path, "rb") as file:
+        encoding = detect_xml_encoding(file.read(256)) or "utf-8"
+        file.seek(0)
+        parser = ET.XMLParser(encoding=encoding.removesuffix("-sig"))
+        stack = []
+        for event, element in ET.iterparse(file, events=("start", "end"), parser=parser):
+            if event == "start":
+                stack.append(element)
+                continue
+            stack.pop()
+            if len(element) == 0 and not element.attrib:
+                continue
+            fields = record_fields(element)
+            if fields is not None:
+                yield fields
+                if stack:
+                    stack[-1].remove(element)
+
+
+class CatalogIndex:
+    # SQLite index of the catalog files in one directory, keyed on EAN and SKU (and on the
+    # description, to fill in a missing item_id). Rows belong to the file they came from;
+    # files are re-indexed when their mtime or size changes and dropped when they disappear,
+    # and a product listed in several files is resolved at lookup.
+
+    def __init__(self, path=CATALOG_INDEX, directory=CATALOG_DIR):
+        self.path = path
+        self.directory = Path(directory)
+        self.refreshed = 0.0
+        self.version = ""  # digest of the indexed files, set by refresh()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        with self._connect() as connection:
+            if connection.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+                # The index only holds what the catalog files contain, so it is rebuilt.
+                connection.executescript("DROP TABLE IF EXISTS products; DROP TABLE IF EXISTS files;")
+                connection.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+            connection.executescript(SCHEMA)
+
+    def _connect(self):
+        return connect_sqlite(self.path)
+
+    def _reader(self):
+        # Lookups reuse one connection per thread; opening one per line would dominate.
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._local.connection = connection
+        return connection
+
+    def refresh(self, force=False):
+        # Returns the number of files (re)indexed or removed.
+        with self._lock:
+            if not force and time.monotonic() - self.refreshed < CATALOG_REFRESH_SECONDS:
+                return 0
+            self.refreshed = time.monotonic()
+            files = {str(path): path.stat() for path in sorted(self.directory.glob("*.xml"))} \
+                if self.directory.is_dir() else {}
+            changed = 0
+            with self._connect() as connection:
+                known = {row[0]: row[1:] for row in connection.execute("SELECT path, mtime_ns, size FROM files")}
+                for path in known.keys() - files.keys():
+                    connection.execute("BEGIN")
+                    connection.execute("DELETE FROM products WHERE file = ?", (path,))
+                    connection.execute("DELETE FROM files WHERE path = ?", (path,))
+                    connection.execute("COMMIT")
+                    changed += 1
+                for path, stat in files.items():
+                    if known.get(path) == (stat.st_mtime_ns, stat.st_size):
+                        continue
+                    start = time.perf_counter()
+                    records = self._index_file(connection, path, stat)
+                    print(f"Catalog {path}: {records} products indexed in {time.perf_counter() - start:.1f}s")
+                    changed += 1
+                rows = connection.execute("SELECT path, mtime_ns, size FROM files ORDER BY path").fetchall()
+            self.version = hashlib.sha256(repr(rows).encode("utf-8")).hexdigest()[:16]
+            return changed
+
+    def _index_file(self, connection, path, stat):
+        # One transaction per file, so a failed parse leaves the previous version in place.
+        connection.execute("BEGIN")
+        try:
+            connection.execute("DELETE FROM products WHERE file = ?", (path,))
+            records, batch = 0, []
+            for record in iter_catalog(path):
+                batch.append(record)
+                records += 1
+                if len(batch) >= 1000:
+                    self._insert(connection, path, batch)
+                    batch = []
+            self._insert(connection, path, batch)
+            connection.execute("INSERT OR REPLACE INTO files (path, mtime_ns, size, records) VALUES (?, ?, ?, ?)",
+                               (path, stat.st_mtime_ns, stat.st_size, records))
+            connection.execute("COMMIT")
+        except (ET.ParseError, LookupError) as e:
+            connection.execute("ROLLBACK")
+            print(f"Catalog {path} skipped: {e}")
+            return 0
+        return records
+
+    def _insert(self, connection, path, records):
+        rows = [(path, record["ean"], record["sku"], record["description"], record["price"]) for record in records]
+        connection.executemany(
+            "INSERT OR REPLACE INTO products (kind, key, file, ean, sku, description, price) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(kind, key, *row) for row in rows
+             for kind, key in (("ean", normalize_ean(row[1])), ("sku", normalize_sku(row[2]))) if key])
+        # A description shared by different products cannot identify one, so its codes and price are cleared.
+        connection.executemany(
+            "INSERT INTO products (kind, key, file, ean, sku, description, price) VALUES ('description', ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (kind, key, file) DO UPDATE SET ean = NULL, sku = NULL, price = NULL "
+            "WHERE ean IS NOT excluded.ean OR sku IS NOT excluded.sku",
+            [(key, *row) for row in rows if (key := normalize_description(row[3]))])
+
+    def lookup(self, item_id=None, description=None):
+        # Returns {"ean", "sku", "description", "price", "matched"} or None.
+        candidates = [("ean", normalize_ean(item_id)), ("sku", normalize_sku(item_id)),
+                      ("description", normalize_description(description))]
+        # The most recently modified file wins; a description that names different products
+        # in different files is returned without codes and price.
+        connection = self._reader()
+        for kind, key in candidates:
+            if key is None:
+                continue
+            rows = connection.execute(
+                "SELECT ean, sku, description, price FROM products JOIN files ON files.path = products.file "
+                "WHERE kind = ? AND key = ? ORDER BY files.mtime_ns DESC", (kind, key)).fetchall()
+            if rows:
+                ean, sku, description, price = rows[0]
+                if kind == "description" and not all(same_product(rows[0], row) for row in rows[1:]):
+                    ean = sku = price = None
+                return {"ean": ean, "sku": sku, "description": description, "price": price, "matched": kind}
+        return None
+
+    def __len__(self):
+        return self._reader().execute("SELECT COALESCE(SUM(records), 0) FROM files").fetchone()[0]
+
+
+def enrich_order(root, index):
+    # Fills empty item_id, item_description and NVT/empty prices from the catalog and
+    # reports values that disagree with it. Values read from the PDF are never overwritten.
+    notes = []
+    for number, orderline in enumerate(root.findall("orderline"), start=1):
+        item_id, description, price = (orderline.find(tag) for tag in ("item_id", "item_description", "price"))
+        item_text = (item_id.text or "").strip() if item_id is not None else ""
+        description_text = (description.text or "").strip() if description is not None else ""
+        product = index.lookup(item_text or None, None if item_text else description_text)
+        if product is None:
+            if item_text:
+                notes.append(f"orderline[{number}]/item_id: {item_text!r} is not in the catalog")
+            continue
+
+        # The prompt prioritizes the EAN for item_id, so the SKU only fills in without one.
+        if item_id is not None and not item_text and (product["ean"] or product["sku"]):
+            item_id.text = product["ean"] or product["sku"]
+            notes.append(f"orderline[{number}]/item_id: filled {item_id.text!r} from the description")
+        if description is not None and not description_text and product["description"]:
+            description.text = product["description"]
+            notes.append(f"orderline[{number}]/item_description: filled {product['description']!r} from the catalog")
+        if price is not None and product["price"]:
+            price_text = (price.text or "").strip()
+            if price_text in ("", "NVT"):
+                price.text = product["price"]
+                notes.append(f"orderline[{number}]/price: filled {product['price']} from the catalog")
+            elif normalize_price(price_text) != product["price"]:
+                notes.append(f"orderline[{number}]/price: {price_text} differs from catalog price {product['price']}")
+    return notes
+
+
+def enrich_order_xml(xml_string, index):
+    # Returns (xml, fills, notes); the document is only re-serialized when a value was filled.
+    root = ET.fromstring(xml_string.strip())
+    notes = enrich_order(root, index)
+    fills = [note for note in notes if ": filled " in note]
+    return (serialize(root) if fills else xml_string), fills, [note for note in notes if note not in fills]
+
+
+catalog_index = None
+
+
+def get_catalog():
+    # The index is opened on first use and only when a catalog directory exists.
+    global catalog_index
+    if not CATALOG_ENRICH or not Path(CATALOG_DIR).is_dir():
+        return None
+    if catalog_index is None:
+        catalog_index = CatalogIndex()
+    catalog_index.refresh()
+    return catalog_index
+
+
+def catalog_version():
+    # Changes whenever a catalog file does, so enriched results are not served stale.
+    catalog = get_catalog()
+    return catalog.version if catalog is not None else "none"
@@ -0,0 +1,66 @@
+import os
+import re
+from utils.common_utils import env_flag
+from utils.template_utils import AMOUNT
+from utils.text_utils import MIN_PAGE_CHARS
+
+
+CHUNKING = env_flag("CHUNKING", True)
+MAX_OUTPUT_TOKENS = int(os.getenv("MAX_OUTPUT_TOKENS", "4000"))
+# Share of max_tokens a single response may be planned to use; the rest is headroom.
+CHUNK_HEADROOM = float(os.getenv("CHUNK_HEADROOM", "0.75"))
+CHUNK_HEADER_PAGES = int(os.getenv("CHUNK_HEADER_PAGES", "2"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "1"))  # pages shared by neighbouring windows
+CHUNK_WORKERS = int(os.getenv("CHUNK_WORKERS", "4"))
+# Pages from which an order is split even when its text layer shows few rows (scans).
+CHUNK_MIN_PAGES = int(os.getenv("CHUNK_MIN_PAGES", "8"))
+HEADER_MAX_TOKENS = 1500
+
+# Rough output sizes of the XML schema in llm_utils.PROMPT, measured on typical orders.
+HEADER_TOKENS = 450
+ORDERLINE_TOKENS = 130
+SCANNED_PAGE_LINES = 25  # rows a page without a usable text layer may hold, when sizing windows
+
+ROW = re.compile(rf"(?:{AMOUNT})[ \t]*$", re.MULTILINE)
+
+
+def page_line_counts(page_texts, scanned=SCANNED_PAGE_LINES):
+    # Item rows end in an amount (price or total); pages without text count as scanned
+    # rows and dropped pages (None) count as empty.
+    return [
+        0 if text is None else len(ROW.findall(text)) if len(text.strip()) >= MIN_PAGE_CHARS else scanned
+        for text in page_texts
+    ]
+
+
+def estimate_output_tokens(page_texts):
+    # Only rows seen in the text layer count; how many rows a scan holds is unknown.
+    return HEADER_TOKENS + ORDERLINE_TOKENS * sum(page_line_counts(page_texts, scanned=0))
+
+
+def plan_windows(page_texts, max_tokens=MAX_OUTPUT_TOKENS, overlap=CHUNK_OVERLAP):
+    # Returns None when one request fits, otherwise two or more the (first, last) page windows
+    # (1-based, inclusive) whose order lines are extracted in separate requests. Orders are
+    # split when their text shows too many rows or when they have CHUNK_MIN_PAGES pages;
+    # windows are then sized with scanned pages counted as full.
+    if not CHUNKING or len(page_texts) < 2:
+        return None
+    pages = sum(1 for text in page_texts if text is not None)
+    if estimate_output_tokens(page_texts) <= max_tokens * CHUNK_HEADROOM and pages < CHUNK_MIN_PAGES:
+        return None
+
+    counts = page_line_counts(page_texts)
+    budget = max(1, int(max_tokens * CHUNK_HEADROOM) // ORDERLINE_TOKENS)
+    windows, start = [], 1
+    for page in range(1, len(counts) + 1):
+        # A page that does not fit on its own still gets a window of its own.
+        if page > start and sum(counts[start - 1:page]) > budget:
+            windows.append((start, page - 1))
+            # Short windows skip the overlap, which would otherwise send most pages twice.
+            start = page - overlap if page - start > 2 * overlap else page
+    windows.append((start, len(counts)))
+    # Windows made up of dropped pages only would be empty requests, and a single window
+    # is better sent as one request (which can also be routed to the fast model).
+    windows = [(first, last) for first, last in windows
+               if any(text is not None for text in page_texts[first - 1:last])]
+    return windows if len(windows) > 1 else None
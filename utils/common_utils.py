@@ -0,0 +1,25 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+
+
+def env_flag(name, default=False):
+    # On/off settings: "1", "true" or "yes" (any case) turn them on, anything else off.
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.lower() in ("1", "true", "yes")
+
+
+@contextmanager
+def connect_sqlite(path, row_factory=None):
+    # Autocommit connection in WAL mode, so several processes can share the file; closing
+    # it rolls back an unfinished BEGIN.
+    connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+    if row_factory is not None:
+        connection.row_factory = row_factory
+    connection.execute("PRAGMA journal_mode=WAL")
+    try:
+        yield connection
+    finally:
+        connection.close()
@@ -0,0 +1,205 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from utils.common_utils import connect_sqlite
+
+
+JOB_DB = os.getenv("JOB_DB", "jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", str(7 * 24 * 3600)))
+PARTIAL_INTERVAL = 1.0  # seconds between partial-output writes while a job streams
+# Running jobs are leased: their queue renews the lease every JOB_HEARTBEAT seconds, and a
+# job whose lease is older than JOB_LEASE is requeued by any queue sharing the database.
+JOB_HEARTBEAT = 10.0
+JOB_LEASE = float(os.getenv("JOB_LEASE", "60"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    filename TEXT,
+    pdf BLOB,
+    email_text TEXT,
+    use_cache INTEGER NOT NULL DEFAULT 1,
+    result TEXT,
+    error TEXT,
+    trace TEXT,
+    worker TEXT,
+    heartbeat REAL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created);
+"""
+
+JOB_FIELDS = "id, status, filename, result, error, trace, created, started, finished"
+
+
+def run_order(job, on_partial):
+    # Default handler: streams through the normal pipeline so that malformed output
+    # is cancelled early and operators can watch the XML arrive.
+    from utils.llm_utils import process_stream
+    from utils.telemetry_utils import trace_order
+
+    with trace_order(entry="job", job_id=job["id"], filename=job["filename"]) as trace:
+        chunks, last_write = [], time.monotonic()
+        stream = process_stream(job["pdf"], job["email_text"], use_cache=bool(job["use_cache"]))
+        while True:
+            try:
+                chunks.append(next(stream))
+            except StopIteration as stop:
+                # The returned document includes any schema fixes made after streaming.
+                xml_output = stop.value if stop.value is not None else "".join(chunks)
+                break
+            if time.monotonic() - last_write >= PARTIAL_INTERVAL:
+                on_partial("".join(chunks))
+                last_write = time.monotonic()
+    return xml_output, trace.to_dict()
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobQueue:
+    # SQLite-backed queue shared by every session of the app (and by other processes
+    # pointing at the same file). Jobs survive browser reconnects and restarts.
+    # worker_id is unique per queue instance, so a restarted process that happens to
+    # reuse a PID does not pass for the one that left jobs running.
+    live_workers = set()  # worker_ids of the queues started in this process
+
+    def __init__(self, path=JOB_DB, workers=JOB_WORKERS, handler=run_order):
+        self.path = path
+        self.workers = workers
+        self.handler = handler
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+            columns = {row["name"] for row in connection.execute("PRAGMA table_info(jobs)")}
+            if "heartbeat" not in columns:
+                connection.execute("ALTER TABLE jobs ADD COLUMN heartbeat REAL")
+
+    def _connect(self):
+        return connect_sqlite(self.path, sqlite3.Row)
+
+    def enqueue(self, pdf_data, email_text=None, filename=None, use_cache=True):
+        job_id = uuid.uuid4().hex
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO jobs (id, status, filename, pdf, email_text, use_cache, created) "
+                "VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, filename, bytes(pdf_data), email_text, int(use_cache), time.time()))
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        with self._connect() as connection:
+            row = connection.execute(f"SELECT {JOB_FIELDS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = dict(row)
+            if job["status"] == "queued":
+                job["position"] = connection.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created <= ?", (job["created"],)
+                ).fetchone()[0]
+        job["trace"] = json.loads(job["trace"]) if job["trace"] else None
+        return job
+
+    def depth(self):
+        # Jobs waiting or running, across every process sharing the database.
+        with self._connect() as connection:
+            return connection.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+
+    def _claim(self):
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1").fetchone()
+            if row is not None:
+                connection.execute("UPDATE jobs SET status = 'running', started = ?, heartbeat = ?, worker = ? "
+                                   "WHERE id = ?", (time.time(), time.time(), self.worker_id, row["id"]))
+            connection.execute("COMMIT")
+        return dict(row) if row is not None else None
+
+    def _update(self, job_id, **fields):
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as connection:
+            connection.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _recover(self):
+        # Running jobs are requeued when their lease expired, or at once when their worker
+        # was on this host and its process is gone, or is this process without being one of
+        # its queues (the PID was reused after a restart).
+        host, now = socket.gethostname(), time.time()
+        with self._connect() as connection:
+            for row in connection.execute(
+                    "SELECT id, worker, heartbeat, started FROM jobs WHERE status = 'running'").fetchall():
+                if row["worker"] == self.worker_id:
+                    continue
+                worker_host, _, pid = (row["worker"] or "").rpartition(":")[0].rpartition(":")
+                stale = now - (row["heartbeat"] or row["started"] or 0) > JOB_LEASE
+                if not stale and worker_host == host and pid.isdigit():
+                    if int(pid) == os.getpid():
+                        stale = row["worker"] not in JobQueue.live_workers
+                    else:
+                        stale = not pid_alive(int(pid))
+                if stale:
+                    connection.execute("UPDATE jobs SET status = 'queued', started = NULL, heartbeat = NULL, "
+                                       "worker = NULL, result = NULL WHERE id = ? AND status = 'running'",
+                                       (row["id"],))
+            connection.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished < ?",
+                               (now - JOB_RETENTION,))
+
+    def _heartbeat(self):
+        # Renews the lease of this queue's running jobs and picks up other queues' expired ones.
+        while not self._stop.wait(JOB_HEARTBEAT):
+            with self._connect() as connection:
+                connection.execute("UPDATE jobs SET heartbeat = ? WHERE status = 'running' AND worker = ?",
+                                   (time.time(), self.worker_id))
+            self._recover()
+            self._wakeup.set()
+
+    def _work(self):
+        while not self._stop.is_set():
+            job = self._claim()
+            if job is None:
+                self._wakeup.wait(timeout=1.0)
+                self._wakeup.clear()
+                continue
+            try:
+                result, trace = self.handler(job, lambda partial: self._update(job["id"], result=partial))
+                self._update(job["id"], status="done", result=result, trace=json.dumps(trace, default=str),
+                             finished=time.time(), pdf=None)
+            except Exception as e:
+                self._update(job["id"], status="failed", error=str(e), result=None, finished=time.time())
+
+    def start(self):
+        JobQueue.live_workers.add(self.worker_id)
+        self._recover()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        return self
+
+    def stop(self):
+        JobQueue.live_workers.discard(self.worker_id)
+        self._stop.set()
+        self._wakeup.set()
@@ -1,15 +1,76 @@
+import asyncio
+import contextvars
 import os
+import threading
+import time
+import xml.etree.ElementTree as ET
 import streamlit as st
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from dotenv import load_dotenv
-from anthropic import Anthropic
-from utils.pdf_utils import pdf_to_images_and_text
-from utils.xml_utils import read_xml_file
+from anthropic import Anthropic, APIError, AsyncAnthropic
+from utils.boilerplate_utils import filter_pages
+from utils.cache_utils import CACHE_ENABLED, cache_key, result_cache
+from utils.catalog_utils import catalog_version, enrich_order_xml, get_catalog
+from utils.chunk_utils import (CHUNK_HEADER_PAGES, CHUNK_WORKERS, HEADER_MAX_TOKENS, MAX_OUTPUT_TOKENS,
+                               estimate_output_tokens, page_line_counts, plan_windows)
+from utils.common_utils import env_flag
+from utils.pdf_utils import PageSpool, format_page_texts, iter_render_pages, load_document, read_pdf
+from utils.request_utils import LLM_MAX_ATTEMPTS, acreate, create, order_deadline, remaining
+from utils.routing_utils import choose_model, escalation_reason, routing_settings
+from utils.schema_utils import SCHEMA_REPAIR, apply_fixes, error_context, fix_order_xml
+from utils.telemetry_utils import record, span, trace_order
+from utils.template_utils import match_template
+from utils.text_utils import TEXT_FAST_PATH, TEXT_QUALITY_THRESHOLD, score_page_text
+from utils.xml_utils import IncrementalXMLValidator, merge_order_xml, read_xml_file, validate_xml
 
 
 load_dotenv()
-# api_key = os.getenv("ANTHROPIC_API_KEY")
-api_key = st.secrets["API_KEY"]
-client = Anthropic(api_key=api_key)
+
+
+def load_api_key():
+    # Streamlit secrets first; headless tools without a secrets file fall back to the environment.
+    try:
+        return st.secrets["API_KEY"]
+    except (KeyError, FileNotFoundError):
+        return os.getenv("ANTHROPIC_API_KEY")
+
+
+client = None
+async_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    # Created on first use and shared by every caller in the process, so importing this
+    # module reads no secrets and opens no connection pool.
+    global client
+    with _client_lock:
+        if client is None:
+            # Retries are left to request_utils, which knows the order's deadline.
+            client = Anthropic(api_key=load_api_key(), max_retries=0)
+        return client
+
+
+def get_async_client():
+    # One connection pool for the process, so keep-alive connections are reused across orders.
+    global async_client
+    with _client_lock:
+        if async_client is None:
+            async_client = AsyncAnthropic(api_key=load_api_key(), max_retries=0)
+        return async_client
+
+
+async def close_async_client():
+    global async_client
+    with _client_lock:
+        closing, async_client = async_client, None
+    if closing is not None:
+        await closing.close()
+
+MODEL = "claude-sonnet-4-20250514"
+PIPELINE_VERSION = 2  # bump when a change to post-processing makes cached results outdated
+CACHE_PREAMBLE = env_flag("PROMPT_CACHE_PREAMBLE")
 
 PROMPT = """
 You are a powerful multimodal assistant with vision-language capabilities. Your goal is to:
@@ -274,51 +335,478 @@ You are a powerful multimodal assistant with vision-language capabilities. Your
   - When in doubt, use the visual image to verify the correct accent mark
 """
 
+HEADER_INSTRUCTION = """
 
-def process(pdf_path, email_text=None):
-    pdf_images, pdf_text = pdf_to_images_and_text(pdf_path)
+This order is too long for a single response, so it is processed in parts. In this part, output the <XML_order> root with its complete <orderheader> block and NO <orderline> elements; the order lines are extracted separately."""
 
-    query = [{
-        "type": "text",
-        "text": "Please analyze the attached PDF. I'm providing it in two formats for better accuracy:\n1. As extracted text\n2. As images (visual representation)\n\nUse both sources to ensure accurate data extraction, especially for product descriptions and technical specifications."
-    }, {
+LINES_INSTRUCTION = """
+
+This order is too long for a single response, so it is processed in parts. In this part you are given pages {first}-{last} only. Output an <XML_order> root containing ONLY the <orderline> elements for the product lines printed on these pages, following all order-line rules, and no <orderheader>. Include every product line shown on these pages, even one that may also appear on a neighbouring page. If a line has no delivery date of its own, leave <deliverydate></deliverydate> empty."""
+
+REPAIR_INSTRUCTION = """
+
+The <XML_order> below was extracted from this order, but the listed fields break the schema rules. Look up the correct value of each listed field in the PDF text and the email text, and answer with ONLY this XML, one <fix> per listed field, using the field paths exactly as listed ("@name" is an attribute, "[ATT]" or "[BID]" the text of that block):
+<fixes>
+  <fix field="orderline[3]/price">1234.50</fix>
+</fixes>
+Use "NVT" where the rules allow it and the value is not in the document."""
+REPAIR_MAX_TOKENS = 1000
+
+
+def build_query(pdf_images, pdf_text, email_text=None, text_only_pages=()):
+    # text_only_pages lists the pages whose text layer was trusted and not rendered.
+    if pdf_images:
+        query = [{
+            "type": "text",
+            "text": "Please analyze the attached PDF. I'm providing it in two formats for better accuracy:\n1. As extracted text\n2. As images (visual representation)\n\nUse both sources to ensure accurate data extraction, especially for product descriptions and technical specifications."
+        }]
+        sources = "text and images"
+    else:
+        query = [{
+            "type": "text",
+            "text": "Please analyze the attached PDF. It is a born-digital document whose text layer was extracted reliably, so I'm providing it as extracted text only.\n\nRead the text carefully to ensure accurate data extraction, especially for product descriptions and technical specifications."
+        }]
+        sources = "text"
+    if CACHE_PREAMBLE:
+        # The opening block never changes, so it extends the cached system prefix.
+        query[0]["cache_control"] = {"type": "ephemeral"}
+
+    query.append({
         "type": "text",
         "text": f"\n\n=== PDF TEXT CONTENT ===\n{pdf_text}\n=== END PDF TEXT ==="
-    }, {
-        "type": "text",
-        "text": "\n\nNow here are the PDF pages as images:"
-    }]
+    })
 
-    for i, img_base64 in enumerate(pdf_images):
+    if pdf_images and text_only_pages:
+        query.append({
+            "type": "text",
+            "text": f"\n\nNow here are images of the pages whose text extraction may be unreliable. Pages {', '.join(map(str, text_only_pages))} are provided as text only:"
+        })
+    elif pdf_images:
+        query.append({
+            "type": "text",
+            "text": "\n\nNow here are the PDF pages as images:"
+        })
+
+    for i, page_image in enumerate(pdf_images):
+        if text_only_pages:
+            query.append({"type": "text", "text": f"Page {page_image['page']}:"})
         query.append({
             "type": "image",
             "source": {
                 "type": "base64",
-                "media_type": "image/png",
-                "data": img_base64
+                "media_type": page_image["media_type"],
+                "data": page_image["data"]
             }
         })
 
     if email_text:
         query.append({
             "type": "text",
-            "text": f"\n\nAdditionally, here is the email text that accompanied this PDF order:\n\n{email_text}\n\nPlease analyze the email text for additional context and information (such as client numbers, references, special instructions, etc.) and incorporate relevant details into the final output according to the schema rules. Use both the PDF content (text and images) and email text to generate the most accurate XML. Output only the final <XML_order> document."
+            "text": f"\n\nAdditionally, here is the email text that accompanied this PDF order:\n\n{email_text}\n\nPlease analyze the email text for additional context and information (such as client numbers, references, special instructions, etc.) and incorporate relevant details into the final output according to the schema rules. Use both the PDF content ({sources}) and email text to generate the most accurate XML. Output only the final <XML_order> document."
         })
     else:
         query.append({
             "type": "text",
-            "text": " according to the schema rules. Note: No email text was provided, so extract all information from the PDF only (using both text and image representations). Output only the final <XML_order> document."
+            "text": f" according to the schema rules. Note: No email text was provided, so extract all information from the PDF only (using the {sources} representation{'s' if pdf_images else ''}). Output only the final <XML_order> document."
         })
 
-    messages = [{"role": "user", "content": query}]
+    return query
+
+
+def build_request(query, model=MODEL, max_tokens=MAX_OUTPUT_TOKENS):
+    return {
+        "model": model,
+        "max_tokens": max_tokens,
+        "temperature": 0.0,
+        # PROMPT is identical for every order, so mark it for prompt caching.
+        "system": [{"type": "text", "text": PROMPT, "cache_control": {"type": "ephemeral"}}],
+        "messages": [{"role": "user", "content": query}],
+    }
+
+
+def usage_report(usage):
+    return {
+        "input_tokens": usage.input_tokens,
+        "output_tokens": usage.output_tokens,
+        "cache_creation_input_tokens": getattr(usage, "cache_creation_input_tokens", None) or 0,
+        "cache_read_input_tokens": getattr(usage, "cache_read_input_tokens", None) or 0,
+    }
+
+
+def lookup_cache(pdf_data, email_text=None, use_cache=True):
+    # Returns (key, cached_xml); key is None when caching is off for this call.
+    if not (use_cache and CACHE_ENABLED):
+        return None, None
+    settings = (f"pipeline {PIPELINE_VERSION}, model {MODEL}, routing {routing_settings()}, "
+                f"repair {SCHEMA_REPAIR}, catalog {catalog_version()}")
+    key = cache_key(pdf_data, email_text, PROMPT, settings)
+    return key, result_cache.get(key)
+
+
+def render_document(pdf_data, page_texts):
+    # Pages whose text is None were dropped as boilerplate and are never rendered.
+    image_pages = [page_num for page_num, page_text in enumerate(page_texts, start=1) if page_text is not None]
+    if TEXT_FAST_PATH:
+        # Only pages whose text layer cannot be trusted are rasterized.
+        with span("text_scoring"):
+            scores = {page_num: score_page_text(page_texts[page_num - 1])[0] for page_num in image_pages}
+        image_pages = [page_num for page_num, score in scores.items() if score < TEXT_QUALITY_THRESHOLD]
+        record(text_quality={page_num: round(score, 2) for page_num, score in scores.items()})
+    if len(image_pages) == len(page_texts):
+        image_pages = None
+
+    # Pages are handed to the spool one at a time as they are encoded; requests read back
+    # only the pages they need.
+    spool = PageSpool()
+    with span("rasterize"):
+        for page in iter_render_pages(pdf_data, len(page_texts), page_numbers=image_pages):
+            spool.add(page)
+    # Per-page sizes, formats and text scores go to the trace; the log gets one line per document.
+    record(pages_rendered=len(spool.pages), spooled_to_disk=spool.spilled,
+           page_images=[{key: value for key, value in page.items() if key != "offset"} for page in spool.pages])
+    print(f"Rendered {len(spool.pages)} of {len(page_texts)} pages: "
+          f"{sum(page['bytes'] for page in spool.pages)} bytes, ~{sum(page['tokens'] for page in spool.pages)} image tokens"
+          f"{', spilled to disk' if spool.spilled else ''}")
+    return spool
+
+
+def page_request(page_texts, spool, email_text=None, pages=None, instruction=None, max_tokens=MAX_OUTPUT_TOKENS,
+                 model=MODEL):
+    # Request for the (first, last) page window, all pages by default.
+    first, last = pages or (1, len(page_texts))
+    pdf_text = format_page_texts(page_texts[first - 1:last], first)
+    pdf_images = spool.load(first, last)
+    rendered = {page["page"] for page in pdf_images}
+    text_only_pages = [page_num for page_num in range(first, last + 1)
+                       if page_num not in rendered and page_texts[page_num - 1] is not None]
+    with span("request_build"):
+        query = build_query(pdf_images, pdf_text, email_text, text_only_pages)
+        if instruction:
+            query.append({"type": "text", "text": instruction})
+        return build_request(query, model=model, max_tokens=max_tokens)
+
+
+def record_payload(page_texts, spool, windows, model=MODEL):
+    # Page text and image data per request; pages shared by two windows are sent twice.
+    payload_bytes = 0
+    for first, last in windows:
+        payload_bytes += sum(len(page_text) for page_text in page_texts[first - 1:last] if page_text)
+        payload_bytes += sum(page["bytes"] for page in spool.pages if first <= page["page"] <= last)
+    record(model=model, payload_bytes=payload_bytes, image_tokens=sum(page["tokens"] for page in spool.pages))
+
+
+def prepare_request(pdf_data, page_texts, email_text=None, model=MODEL):
+    spool = render_document(pdf_data, page_texts)
+    request = page_request(page_texts, spool, email_text, model=model)
+    record_payload(page_texts, spool, [(1, len(page_texts))], model)
+    spool.close()
+    return request
+
+
+def prepare_chunks(pdf_data, page_texts, email_text, windows):
+    # One header request on the first pages plus one order-line request per window. Every
+    # part gets the email text, which can hold line data (BID/PGO numbers, dropship). Returns
+    # (builders, spool): request builders, so only the windows being sent are loaded from
+    # the spool at a time, and the spool, which the caller closes once they have run.
+    spool = render_document(pdf_data, page_texts)
+    header_pages = (1, min(CHUNK_HEADER_PAGES, len(page_texts)))
+    builders = [partial(page_request, page_texts, spool, email_text, header_pages, HEADER_INSTRUCTION,
+                        HEADER_MAX_TOKENS)]
+    for first, last in windows:
+        builders.append(partial(page_request, page_texts, spool, email_text, (first, last),
+                                LINES_INSTRUCTION.format(first=first, last=last)))
+    record_payload(page_texts, spool, [header_pages] + windows)
+    record(chunks=len(windows))
+    return builders, spool
 
-    response = client.messages.create(
-        model="claude-sonnet-4-20250514",  # Using Claude 3.5 Sonnet for vision capabilities
-        max_tokens=4000,
-        temperature=0.0,
-        system=PROMPT,
-        messages=messages
-    )
 
-    xml_output = response.content[0].text
+def plan_document(page_texts):
+    estimate = estimate_output_tokens(page_texts)
+    windows = plan_windows(page_texts)
+    print(f"Estimated output: ~{estimate} tokens"
+          + (f", splitting order lines over pages {', '.join(f'{first}-{last}' for first, last in windows)}" if windows else ""))
+    record(estimated_output_tokens=estimate)
+    return windows
+
+
+def route(page_texts):
+    # Single-request orders that look simple go to FAST_MODEL first.
+    model, score = choose_model(page_texts, MODEL)
+    if score is not None:
+        record(route="fast" if model != MODEL else "full", complexity=round(score, 2))
+    return model
+
+
+def escalate(request, reason, usage=None):
+    # Returns the request for MODEL after a fast-model answer was rejected, or None.
+    if reason is None or request["model"] == MODEL:
+        return None
+    print(f"Escalating from {request['model']} to {MODEL}: {reason}")
+    record(model=MODEL, escalated=reason)
+    if usage is not None:
+        record(fast_input_tokens=usage.input_tokens, fast_output_tokens=usage.output_tokens)
+    return dict(request, model=MODEL)
+
+
+def check_response(request, response, page_texts):
+    if request["model"] == MODEL:
+        return None
+    return escalate(request, escalation_reason(response.content[0].text, response.stop_reason, page_texts),
+                    response.usage)
+
+
+def build_repair_request(xml_output, errors, page_texts, email_text=None):
+    # Text only: the failing fields are looked up in the text layer, not in the page images.
+    fields = "\n".join(f"- {error['field']} = {error['value']!r}: {error['message']}" for error in errors)
+    query = [{
+        "type": "text",
+        "text": f"=== PDF TEXT CONTENT ===\n{format_page_texts(page_texts)}\n=== END PDF TEXT ==="
+    }]
+    if email_text:
+        query.append({"type": "text", "text": f"\n\n=== EMAIL TEXT ===\n{email_text}\n=== END EMAIL TEXT ==="})
+    query.append({
+        "type": "text",
+        "text": f"{REPAIR_INSTRUCTION}\n\n=== CURRENT XML (failing order lines only) ===\n"
+                f"{error_context(xml_output, errors)}\n=== END XML ===\n\nFields to fix:\n{fields}"
+    })
+    return build_request(query, max_tokens=REPAIR_MAX_TOKENS)
+
+
+def repair(xml_output, errors, page_texts, email_text=None):
+    # Returns (xml, remaining_errors); the input is returned unchanged if the repair fails.
+    request = build_repair_request(xml_output, errors, page_texts, email_text)
+    try:
+        with span("repair"):
+            response = create(get_client(), request)
+        repaired, applied = apply_fixes(xml_output, response.content[0].text, {error["field"] for error in errors})
+        repaired, _, remaining = fix_order_xml(repaired)
+    except (APIError, ET.ParseError) as e:
+        print(f"Schema repair failed: {e}")
+        return xml_output, errors
+    record(repair_input_tokens=response.usage.input_tokens, repair_output_tokens=response.usage.output_tokens)
+    print(f"Schema repair: {len(applied)} of {len(errors)} fields updated, {len(remaining)} errors remain")
+    return repaired, remaining
+
+
+def finish(xml_output, usage, stop_reason, key=None, outcome="llm", page_texts=None, email_text=None):
+    # Without page_texts no schema repair is requested; usage is empty when no API call was made.
+    if usage:
+        print(f"Prompt cache: {usage['cache_creation_input_tokens']} tokens written, "
+              f"{usage['cache_read_input_tokens']} tokens read, {usage['input_tokens']} uncached input tokens")
+    record(outcome=outcome, stop_reason=stop_reason, **usage)
+
+    with span("validate_xml"):
+        valid = validate_xml(xml_output)
+        fixes, errors = [], []
+        if valid:
+            xml_output, fixes, errors = fix_order_xml(xml_output)
+    for fix in fixes:
+        print(f"Schema fix: {fix}")
+    for error in errors:
+        print(f"Schema error: {error['field']} = {error['value']!r}: {error['message']}")
+    if errors and SCHEMA_REPAIR and page_texts and any(page_texts):
+        xml_output, errors = repair(xml_output, errors, page_texts, email_text)
+    record(valid_xml=valid, schema_fixes=len(fixes), schema_errors=len(errors))
+
+    catalog = get_catalog() if valid else None
+    if catalog is not None:
+        with span("catalog"):
+            xml_output, fills, notes = enrich_order_xml(xml_output, catalog)
+        for note in fills + notes:
+            print(f"Catalog: {note}")
+        record(catalog_fills=len(fills), catalog_mismatches=len(notes))
+
+    # Only well-formed results are cached, so a retry can still recover from a bad generation.
+    if key is not None and valid:
+        result_cache.put(key, xml_output)
     return xml_output
+
+
+def handle_response(response, key=None, page_texts=None, email_text=None):
+    return finish(response.content[0].text, usage_report(response.usage), response.stop_reason, key,
+                  page_texts=page_texts, email_text=email_text)
+
+
+def send(build):
+    return create(get_client(), build())
+
+
+def create_all(builders):
+    # Each request is built in its worker; the context copy keeps its spans in the order's trace.
+    with ThreadPoolExecutor(max_workers=CHUNK_WORKERS) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, send, build) for build in builders]
+        return [future.result() for future in futures]
+
+
+def handle_chunks(responses, windows, key=None, page_texts=None, email_text=None):
+    usage = {}
+    for response in responses:
+        for name, value in usage_report(response.usage).items():
+            usage[name] = usage.get(name, 0) + value
+    # A truncated part means missing lines, so it is reported even if the merge succeeds.
+    stop_reasons = [response.stop_reason for response in responses]
+    stop_reason = "max_tokens" if "max_tokens" in stop_reasons else stop_reasons[0]
+
+    with span("merge"):
+        try:
+            xml_output = merge_order_xml(responses[0].content[0].text,
+                                         [response.content[0].text for response in responses[1:]], windows,
+                                         page_line_counts(page_texts) if page_texts else None)
+        except ET.ParseError as e:
+            record(outcome="llm_chunked", stop_reason=stop_reason, valid_xml=False, **usage)
+            raise ValueError(f"Could not merge the order parts: {e}") from e
+    return finish(xml_output, usage, stop_reason, key, "llm_chunked", page_texts, email_text)
+
+
+def local_result(pdf_data, email_text=None, use_cache=True):
+    # Returns (key, document, xml): xml is set when the cache or a layout template
+    # answered, document is the loaded (pdf_data, page_texts) otherwise, with the
+    # text of boilerplate pages replaced by None.
+    pdf_data = read_pdf(pdf_data)
+    with span("cache_lookup"):
+        key, cached_xml = lookup_cache(pdf_data, email_text, use_cache)
+    if cached_xml is not None:
+        record(outcome="cache_hit")
+        return key, None, cached_xml
+
+    pdf_data, page_texts = load_document(pdf_data)
+    with span("template"):
+        template_xml = match_template(page_texts, email_text)
+    if template_xml is not None:
+        # Checked, fixed, enriched and cached like a model answer; a template never needs a repair request.
+        return key, None, finish(template_xml, {}, None, key, "template")
+
+    with span("boilerplate"):
+        page_texts, skipped = filter_pages(page_texts)
+    if skipped:
+        print(f"Skipping boilerplate pages: {', '.join(f'{page_num} ({reason})' for page_num, reason in skipped)}")
+    record(pages_skipped=len(skipped))
+    return key, (pdf_data, page_texts), None
+
+
+def process(pdf_data, email_text=None, use_cache=True):
+    # pdf_data is the uploaded PDF as bytes or a memoryview (a file path also works).
+    with trace_order(entry="process"), order_deadline():
+        key, document, xml_output = local_result(pdf_data, email_text, use_cache)
+        if xml_output is not None:
+            return xml_output
+
+        windows = plan_document(document[1])
+        if windows:
+            builders, spool = prepare_chunks(*document, email_text, windows)
+            try:
+                with span("api_call"):
+                    responses = create_all(builders)
+            finally:
+                spool.close()
+            return handle_chunks(responses, windows, key, document[1], email_text)
+
+        request = prepare_request(*document, email_text, route(document[1]))
+        with span("api_call"):
+            response = create(get_client(), request)
+        escalated = check_response(request, response, document[1])
+        if escalated is not None:
+            with span("escalation"):
+                response = create(get_client(), escalated)
+        return handle_response(response, key, document[1], email_text)
+
+
+async def aprocess(pdf_data, email_text=None, use_cache=True):
+    # Same pipeline as process(); PDF work runs in a thread to keep the event loop free.
+    with trace_order(entry="aprocess"), order_deadline():
+        key, document, xml_output = await asyncio.to_thread(local_result, pdf_data, email_text, use_cache)
+        if xml_output is not None:
+            return xml_output
+
+        windows = plan_document(document[1])
+        if windows:
+            builders, spool = await asyncio.to_thread(prepare_chunks, *document, email_text, windows)
+            semaphore = asyncio.Semaphore(CHUNK_WORKERS)
+
+            async def send_chunk(build):
+                async with semaphore:
+                    request = await asyncio.to_thread(build)
+                    return await acreate(get_async_client(), request)
+
+            tasks = [asyncio.ensure_future(send_chunk(build)) for build in builders]
+            try:
+                with span("api_call"):
+                    responses = await asyncio.gather(*tasks)
+            finally:
+                # Parts still in flight when one fails are stopped before their pages go away.
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                spool.close()
+            # A schema repair is a blocking request, so the checks run in a thread as well.
+            return await asyncio.to_thread(handle_chunks, responses, windows, key, document[1], email_text)
+
+        request = await asyncio.to_thread(prepare_request, *document, email_text, route(document[1]))
+        with span("api_call"):
+            response = await acreate(get_async_client(), request)
+        escalated = check_response(request, response, document[1])
+        if escalated is not None:
+            with span("escalation"):
+                response = await acreate(get_async_client(), escalated)
+        return await asyncio.to_thread(handle_response, response, key, document[1], email_text)
+
+
+def process_stream(pdf_data, email_text=None, use_cache=True):
+    # Yields the XML as it is generated. Output is validated incrementally and the
+    # stream is closed (cancelling generation) on the first parse error, which is re-raised.
+    # Long orders are processed in parts and yielded once merged. The generator returns
+    # the final document, which differs from the streamed text when schema fixes were applied
+    # or a fast-model answer was escalated.
+    with trace_order(entry="process_stream"), order_deadline():
+        key, document, xml_output = local_result(pdf_data, email_text, use_cache)
+        if xml_output is not None:
+            yield xml_output
+            return xml_output
+
+        windows = plan_document(document[1])
+        if windows:
+            builders, spool = prepare_chunks(*document, email_text, windows)
+            try:
+                with span("api_call"):
+                    responses = create_all(builders)
+            finally:
+                spool.close()
+            xml_output = handle_chunks(responses, windows, key, document[1], email_text)
+            yield xml_output
+            return xml_output
+
+        request = prepare_request(*document, email_text, route(document[1]))
+        validator = IncrementalXMLValidator()
+        # A stream cannot be retried once it has produced text, so the SDK's own retries
+        # (which only cover opening it) are used here.
+        streaming_client = get_client().with_options(max_retries=LLM_MAX_ATTEMPTS - 1, timeout=remaining())
+        try:
+            with span("api_call"), streaming_client.messages.stream(**request) as stream:
+                start, first_chunk = time.perf_counter(), True
+                for chunk in stream.text_stream:
+                    if first_chunk:
+                        record(time_to_first_token=time.perf_counter() - start)
+                        first_chunk = False
+                    validator.feed(chunk)
+                    yield chunk
+                response = stream.get_final_message()
+            if response.stop_reason == "max_tokens":
+                # The rest of a truncated answer is requested without streaming and yielded at once.
+                streamed = response.content[0].text.rstrip()
+                with span("continuation"):
+                    response = create(get_client(), request, response)
+                rest = response.content[0].text[len(streamed):]
+                validator.feed(rest)
+                yield rest
+            validator.close()
+            escalated = check_response(request, response, document[1])
+        except ET.ParseError:
+            escalated = escalate(request, "invalid_xml")
+            if escalated is None:
+                raise
+        # The large model's answer is not streamed; it is only the generator's return value.
+        if escalated is not None:
+            with span("escalation"):
+                response = create(get_client(), escalated)
+
+        return handle_response(response, key, document[1], email_text)
@@ -0,0 +1,140 @@
+import hashlib
+import html
+import mailbox
+import os
+import re
+import time
+from email import policy
+from email.parser import BytesParser
+from functools import partial
+from pathlib import Path
+from utils.common_utils import connect_sqlite
+
+
+MAIL_DB = os.getenv("MAIL_DB", "mail.sqlite3")
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", "3"))  # failed attempts before a message is given up
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    message_id TEXT PRIMARY KEY,
+    source TEXT,
+    status TEXT NOT NULL,
+    orders INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    processed REAL NOT NULL
+);
+"""
+
+parser = BytesParser(policy=policy.default)
+
+
+def iter_message_files(source):
+    # Yields (label, open_message) for every message in a maildir, an mbox file, an
+    # .eml file or a directory of .eml/.mbox files. open_message returns a binary file
+    # object, so a message is only read when it is needed. Subdirectories are searched too.
+    path = Path(source)
+    if path.is_dir() and all((path / name).is_dir() for name in ("cur", "new", "tmp")):
+        box = mailbox.Maildir(path, factory=None, create=False)
+        for key in sorted(box.iterkeys()):
+            yield f"{path.name}/{key}", partial(box.get_file, key)
+    elif path.is_dir():
+        for child in sorted(path.iterdir()):
+            if child.is_dir() or child.suffix.lower() in (".eml", ".mbox"):
+                yield from iter_message_files(child)
+    elif path.suffix.lower() == ".eml":
+        yield path.name, partial(open, path, "rb")
+    else:
+        box = mailbox.mbox(path, factory=None, create=False)
+        for key in box.iterkeys():
+            yield f"{path.name}#{key}", partial(box.get_file, key)
+
+
+def read_message_id(file):
+    # Only the headers are parsed. Messages without a Message-ID are keyed on a hash
+    # of their bytes, which is stable across rescans.
+    message_id = parser.parse(file, headersonly=True).get("Message-ID", "")
+    message_id = message_id.strip().strip("<>").strip()
+    if message_id:
+        return message_id
+    file.seek(0)
+    digest = hashlib.sha256()
+    while chunk := file.read(1 << 16):
+        digest.update(chunk)
+    return f"sha256:{digest.hexdigest()}"
+
+
+def is_pdf(part):
+    filename = (part.get_filename() or "").lower()
+    return part.get_content_type() == "application/pdf" or (
+        filename.endswith(".pdf") and part.get_content_maintype() == "application")
+
+
+def html_to_text(value):
+    value = re.sub(r"(?is)<(script|style)\b.*?</\1>", "", value)
+    value = re.sub(r"(?i)<br\s*/?>|</(?:p|div|tr|li|h\d)>", "\n", value)
+    return html.unescape(re.sub(r"<[^>]+>", "", value))
+
+
+def order_parts(message):
+    # Returns ([(filename, pdf_bytes)], email_text). PDFs are found at any depth,
+    # including inside forwarded messages; the text is the subject and the plain body
+    # (the HTML body with tags removed when there is no plain one).
+    pdfs = []
+    for part in message.walk():
+        if not part.is_multipart() and is_pdf(part):
+            pdfs.append((part.get_filename() or f"attachment_{len(pdfs) + 1}.pdf", part.get_content()))
+
+    body = message.get_body(preferencelist=("plain", "html"))
+    text = ""
+    if body is not None:
+        text = body.get_content()
+        if body.get_content_subtype() == "html":
+            text = html_to_text(text)
+    text = "\n".join(line.rstrip() for line in text.strip().splitlines())
+    subject = message.get("Subject", "").strip()
+    email_text = "\n\n".join(value for value in (subject, text) if value)
+    return pdfs, email_text or None
+
+
+def read_message(open_message):
+    with open_message() as file:
+        return parser.parse(file)
+
+
+class MailStore:
+    # Message-IDs that were processed, so rescanning a mailbox skips them. Failed
+    # messages are kept with their error and retried on the next scan, until they
+    # failed max_attempts times.
+
+    def __init__(self, path=MAIL_DB, max_attempts=MAIL_MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+
+    def _connect(self):
+        return connect_sqlite(self.path)
+
+    def skip_reason(self, message_id):
+        # "done", "given up" or None when the message is to be processed.
+        with self._connect() as connection:
+            row = connection.execute("SELECT status, attempts FROM messages WHERE message_id = ?",
+                                     (message_id,)).fetchone()
+        if row is None:
+            return None
+        if row[0] == "done":
+            return "done"
+        return "given up" if row[1] >= self.max_attempts else None
+
+    def mark(self, message_id, source, status, orders=0, error=None):
+        # Returns the number of attempts made on the message so far.
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO messages (message_id, source, status, orders, error, attempts, processed) "
+                "VALUES (?, ?, ?, ?, ?, 1, ?) "
+                "ON CONFLICT (message_id) DO UPDATE SET source = excluded.source, status = excluded.status, "
+                "orders = excluded.orders, error = excluded.error, attempts = attempts + 1, "
+                "processed = excluded.processed",
+                (message_id, source, status, orders, error, time.time()))
+            return connection.execute("SELECT attempts FROM messages WHERE message_id = ?", (message_id,)).fetchone()[0]
@@ -1,58 +1,427 @@
 import base64
-from PyPDF2 import PdfReader, PdfWriter
-from pdf2image import convert_from_bytes
+import math
+import os
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from PIL import Image, ImageOps
+from PyPDF2 import PdfReader
+from utils.telemetry_utils import record, span
 from io import BytesIO
 
 
-def process_page(pdf_reader, page_num):
-    page = pdf_reader.pages[page_num]
-    output = BytesIO()
-    writer = PdfWriter()
-    writer.add_page(page)
-    writer.write(output)
-    page_bytes = output.getvalue()
+RENDER_DPI = 200
+# "sequential" renders one page per poppler call, "thread"/"process" split the
+# document into one page range per worker, "document" starts poppler once.
+RENDER_MODE = os.getenv("PDF_RENDER_MODE", "document")
+RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", "0")) or os.cpu_count() or 1
 
-    images = convert_from_bytes(page_bytes, dpi=200, first_page=1, last_page=1)
+# "adaptive" picks size, colour mode, format and crop per page; "png" sends the full render.
+IMAGE_ENCODING = os.getenv("IMAGE_ENCODING", "adaptive")
+IMAGE_TOKEN_BUDGET = int(os.getenv("IMAGE_TOKEN_BUDGET", "0"))  # per document, 0 = no budget
+JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+# Claude downscales anything beyond these limits server-side, so larger uploads are wasted.
+MAX_LONG_EDGE = 1568
+MAX_PIXELS = 1_150_000
+PIXELS_PER_TOKEN = 750
 
+# Rough ceiling for one order's PDF stages: half of it bounds the raw pages being rendered
+# at once, the other half the encoded pages kept in memory before they spill to a temp file.
+PIPELINE_MEMORY_MB = int(os.getenv("PIPELINE_MEMORY_MB", "256"))
+SPOOL_MEMORY_BYTES = PIPELINE_MEMORY_MB * 1024 * 1024 // 2
+
+
+def read_pdf(source):
+    # Accepts a path, bytes or a memoryview and returns the raw document bytes.
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as file:
+            source = file.read()
+    return memoryview(source)
+
+
+def load_pdf(source):
+    # The document is read and parsed once; callers share the returned reader.
+    pdf_data = read_pdf(source)
+    with span("pdf_parse"):
+        pdf_reader = PdfReader(BytesIO(pdf_data))
+    record(pages=len(pdf_reader.pages), pdf_bytes=len(pdf_data))
+    return pdf_data, pdf_reader
+
+
+def estimate_image_tokens(width, height):
+    scale = min(1.0, MAX_LONG_EDGE / max(width, height), math.sqrt(MAX_PIXELS / (width * height)))
+    return math.ceil(int(width * scale) * int(height * scale) / PIXELS_PER_TOKEN)
+
+
+def encode_png(image):
     img_buffer = BytesIO()
-    images[0].save(img_buffer, format='PNG')
+    image.save(img_buffer, format='PNG')
     encoded_content = base64.b64encode(img_buffer.getvalue()).decode("utf-8")
-
-    output.close()
     img_buffer.close()
-
     return encoded_content
 
 
-def pdf_to_images(pdf_path):
-    encoded_images = []
+def encode_page_png(image, token_budget=None):
+    return {
+        "media_type": "image/png",
+        "data": encode_png(image),
+        "width": image.width,
+        "height": image.height,
+        "mode": image.mode,
+        "format": "PNG",
+        "quality": None,
+        "crop": None,
+        "tokens": estimate_image_tokens(image.width, image.height),
+    }
 
-    with open(pdf_path, 'rb') as file:
-        pdf_reader = PdfReader(file)
-        for page_num in range(len(pdf_reader.pages)):
-            page_encoded = process_page(pdf_reader, page_num)
-            encoded_images.append(page_encoded)
 
-    return encoded_images
+def content_bbox(gray, margin=12):
+    # Bounding box of everything darker than near-white, padded by a small margin.
+    bbox = ImageOps.invert(gray).point(lambda p: 255 if p > 24 else 0).getbbox()
+    if bbox is None:
+        return None
+    left, top, right, bottom = bbox
+    return (max(0, left - margin), max(0, top - margin),
+            min(gray.width, right + margin), min(gray.height, bottom + margin))
 
 
-def pdf_to_text(pdf_path):
-    text_content = []
+def colour_mode(image, gray):
+    # Sample a thumbnail: any noticeable saturation keeps colour, a near two-tone
+    # histogram (typical for clean text pages) goes bilevel, otherwise grayscale.
+    sample = image.copy()
+    sample.thumbnail((256, 256))
+    saturation = sample.convert("HSV").getchannel("S").histogram()
+    if sum(saturation[48:]) > 0.01 * sample.width * sample.height:
+        return "RGB"
+    histogram = gray.histogram()
+    extremes = sum(histogram[:64]) + sum(histogram[192:])
+    return "1" if extremes > 0.98 * gray.width * gray.height else "L"
+
+
+def encode_page_adaptive(image, token_budget=None):
+    image = image.convert("RGB")
+    gray = image.convert("L")
+
+    crop = content_bbox(gray)
+    if crop is not None and crop != (0, 0, image.width, image.height):
+        image, gray = image.crop(crop), gray.crop(crop)
+
+    mode = colour_mode(image, gray)
+    image = gray if mode in ("L", "1") else image
+
+    max_pixels = MAX_PIXELS
+    if token_budget:
+        max_pixels = min(max_pixels, token_budget * PIXELS_PER_TOKEN)
+    scale = min(1.0, MAX_LONG_EDGE / max(image.size), math.sqrt(max_pixels / (image.width * image.height)))
+    if scale < 1.0:
+        image = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))),
+                             Image.LANCZOS)
+    if mode == "1":
+        # Threshold after resampling so that downscaled text keeps its strokes.
+        image = image.point(lambda p: 255 if p > 160 else 0).convert("1")
+
+    candidates = []
+    png_buffer = BytesIO()
+    image.save(png_buffer, format="PNG", optimize=True)
+    candidates.append((png_buffer.getvalue(), "PNG", None))
+    if mode != "1":
+        jpeg_buffer = BytesIO()
+        image.save(jpeg_buffer, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+        candidates.append((jpeg_buffer.getvalue(), "JPEG", JPEG_QUALITY))
+    data, image_format, quality = min(candidates, key=lambda candidate: len(candidate[0]))
+
+    return {
+        "media_type": f"image/{image_format.lower()}",
+        "data": base64.b64encode(data).decode("utf-8"),
+        "width": image.width,
+        "height": image.height,
+        "mode": mode,
+        "format": image_format,
+        "quality": quality,
+        "crop": crop,
+        "tokens": math.ceil(image.width * image.height / PIXELS_PER_TOKEN),
+    }
+
+
+def page_encoder(page_count=None, encoding=None, token_budget=None):
+    encoding = encoding or IMAGE_ENCODING
+    token_budget = IMAGE_TOKEN_BUDGET if token_budget is None else token_budget
+    if encoding == "png":
+        encoder = encode_page_png
+    elif encoding == "adaptive":
+        encoder = encode_page_adaptive
+    else:
+        raise ValueError(f"Unknown image encoding: {encoding}")
+    # The document budget is shared evenly between pages.
+    page_budget = token_budget // page_count if token_budget and page_count else None
+    return partial(encoder, token_budget=page_budget)
+
+
+def read_ppm(stream):
+    # Reads one binary PPM/PGM image from the stream; None at end of stream.
+    tokens, token = [], b""
+    while len(tokens) < 4:
+        char = stream.read(1)
+        if not char:
+            if tokens or token:
+                raise RuntimeError("pdftoppm output ended inside a page header")
+            return None
+        if char == b"#" and not token:
+            stream.readline()
+        elif char.isspace():
+            if token:
+                tokens.append(token)
+                token = b""
+        else:
+            token += char
+    magic, width, height = tokens[0], int(tokens[1]), int(tokens[2])
+    mode = {b"P6": "RGB", b"P5": "L"}[magic]
+    size = width * height * (3 if mode == "RGB" else 1)
+    data = stream.read(size)
+    if len(data) != size:
+        raise RuntimeError("pdftoppm output ended inside a page")
+    return Image.frombytes(mode, (width, height), data)
+
+
+def feed_stdin(stdin, data):
+    try:
+        stdin.write(data)
+        stdin.close()
+    except (BrokenPipeError, OSError):
+        pass
+
+
+def drain(stream, chunks):
+    # Poppler would block on a full stderr pipe, so it is read while pages are produced.
+    chunks.append(stream.read())
+    stream.close()
+
+
+def iter_rasterize(pdf_data, dpi=RENDER_DPI, first_page=None, last_page=None):
+    # pdf2image.convert_from_bytes spills the document to a temp file first, so feed
+    # poppler through stdin instead. Pages are read off its stdout one at a time; the
+    # pipe blocks poppler while a page is being processed, so one raw page is in memory.
+    args = ["pdftoppm", "-r", str(dpi)]
+    if first_page is not None:
+        args += ["-f", str(first_page)]
+    if last_page is not None:
+        args += ["-l", str(last_page)]
+    args.append("-")
+
+    process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stderr = []
+    writer = threading.Thread(target=feed_stdin, args=(process.stdin, pdf_data), daemon=True)
+    reader = threading.Thread(target=drain, args=(process.stderr, stderr), daemon=True)
+    writer.start()
+    reader.start()
+    finished = False
+    try:
+        while (image := read_ppm(process.stdout)) is not None:
+            yield image
+        finished = True
+    finally:
+        if not finished:
+            process.kill()  # the consumer stopped early or the output was malformed
+        process.stdout.close()
+        returncode = process.wait()
+        writer.join()
+        reader.join()
+    if returncode != 0:
+        raise RuntimeError(f"pdftoppm failed: {b''.join(stderr).decode('utf-8', errors='ignore').strip()}")
+
+
+def rasterize(pdf_data, dpi=RENDER_DPI, first_page=None, last_page=None):
+    return list(iter_rasterize(pdf_data, dpi, first_page, last_page))
+
+
+def render_range(pdf_data, first_page, last_page, dpi=RENDER_DPI, encoder=encode_page_png):
+    return [encoder(image) for image in iter_rasterize(pdf_data, dpi, first_page, last_page)]
+
+
+def contiguous_runs(page_numbers):
+    runs = []
+    for page in page_numbers:
+        if runs and runs[-1][1] == page - 1:
+            runs[-1] = (runs[-1][0], page)
+        else:
+            runs.append((page, page))
+    return runs
+
 
-    with open(pdf_path, 'rb') as file:
-        pdf_reader = PdfReader(file)
-        for page_num in range(len(pdf_reader.pages)):
-            page = pdf_reader.pages[page_num]
-            page_text = page.extract_text()
-            if page_text:
-                text_content.append(f"=== Page {page_num + 1} ===\n{page_text}")
+def page_ranges(page_numbers, chunks):
+    # Split the pages into `chunks` near-equal slices, each made of contiguous runs.
+    size, extra = divmod(len(page_numbers), chunks)
+    ranges, start = [], 0
+    for i in range(chunks):
+        end = start + size + (1 if i < extra else 0)
+        ranges.extend(contiguous_runs(page_numbers[start:end]))
+        start = end
+    return ranges
+
+
+def raw_page_bytes(dpi=RENDER_DPI):
+    # An A4 page as 24-bit RGB; encoding briefly holds a few converted copies of it.
+    return int(8.27 * dpi) * int(11.69 * dpi) * 3 * 3
+
+
+def iter_render_pages(pdf_data, page_count=None, mode=None, workers=None, dpi=RENDER_DPI,
+                      encoding=None, token_budget=None, page_numbers=None):
+    # Yields every encoded page, or only `page_numbers` (1-based) when given, in document
+    # order as soon as it is ready. One raw page is held at a time, one per worker in the
+    # pooled modes, whose worker count is capped by the memory ceiling.
+    mode = mode or RENDER_MODE
+    workers = min(workers or RENDER_WORKERS, max(1, SPOOL_MEMORY_BYTES // raw_page_bytes(dpi)))
+
+    if page_numbers is None and (mode == "document" or page_count is None):
+        encoder = page_encoder(page_count, encoding, token_budget)
+        for page, image in enumerate(iter_rasterize(pdf_data, dpi), start=1):
+            yield encoder(image) | {"page": page}
+        return
+
+    page_numbers = sorted(page_numbers) if page_numbers is not None else list(range(1, page_count + 1))
+    if not page_numbers:
+        return
+    encoder = page_encoder(len(page_numbers), encoding, token_budget)
+
+    if mode == "sequential":
+        ranges = [(page, page) for page in page_numbers]
+    elif mode == "document":
+        ranges = contiguous_runs(page_numbers)
+    else:
+        ranges = page_ranges(page_numbers, min(workers, len(page_numbers)))
+
+    pages = iter(page_numbers)
+    for chunk in render_ranges(pdf_data, ranges, mode, workers, dpi, encoder):
+        for encoded in chunk:
+            yield encoded | {"page": next(pages)}
+
+
+def render_pages(pdf_data, page_count=None, mode=None, workers=None, dpi=RENDER_DPI,
+                 encoding=None, token_budget=None, page_numbers=None):
+    # Poppler and encoding overlap, so they are timed together.
+    with span("rasterize"):
+        encoded_pages = list(iter_render_pages(pdf_data, page_count, mode, workers, dpi,
+                                               encoding, token_budget, page_numbers))
+    record(pages_rendered=len(encoded_pages))
+    return encoded_pages
+
+
+def render_ranges(pdf_data, ranges, mode, workers, dpi, encoder):
+    # Yields the encoded pages of each range, in range order.
+    if mode in ("sequential", "document") or len(ranges) <= 1:
+        for first, last in ranges:
+            yield render_range(pdf_data, first, last, dpi, encoder)
+        return
+
+    if mode == "thread":
+        executor = ThreadPoolExecutor(max_workers=min(workers, len(ranges)))
+    elif mode == "process":
+        executor = ProcessPoolExecutor(max_workers=min(workers, len(ranges)))
+        pdf_data = bytes(pdf_data)  # memoryviews cannot be pickled
+    else:
+        raise ValueError(f"Unknown render mode: {mode}")
+    # map() yields results in submission order, so pages stay in document order.
+    with executor:
+        yield from executor.map(
+            render_range,
+            [pdf_data] * len(ranges),
+            [first for first, _ in ranges],
+            [last for _, last in ranges],
+            [dpi] * len(ranges),
+            [encoder] * len(ranges),
+        )
+
+
+class PageSpool:
+    # Encoded pages in one SpooledTemporaryFile: the base64 data stays in memory up to
+    # max_size bytes and spills to disk beyond that. Page metadata is kept in `pages`.
+
+    def __init__(self, max_size=SPOOL_MEMORY_BYTES):
+        self.file = tempfile.SpooledTemporaryFile(max_size=max_size)
+        self.max_size = max_size
+        self.size = 0
+        self.pages = []
+        self._lock = threading.Lock()
+
+    def add(self, encoded):
+        data = encoded["data"].encode("ascii")
+        with self._lock:
+            self.file.seek(0, os.SEEK_END)
+            offset = self.file.tell()
+            self.file.write(data)
+            self.size = offset + len(data)
+            self.pages.append({key: value for key, value in encoded.items() if key != "data"}
+                              | {"offset": offset, "bytes": len(data)})
+
+    def load(self, first=1, last=None):
+        # The pages numbered first..last (inclusive) with their data read back.
+        loaded = []
+        with self._lock:
+            for page in self.pages:
+                if page["page"] < first or (last is not None and page["page"] > last):
+                    continue
+                self.file.seek(page["offset"])
+                data = self.file.read(page["bytes"]).decode("ascii")
+                loaded.append({key: value for key, value in page.items() if key not in ("offset", "bytes")}
+                              | {"data": data})
+        return loaded
+
+    @property
+    def spilled(self):
+        # The file moves to disk once a write takes it past max_size, and stays there.
+        return bool(self.max_size) and self.size > self.max_size
+
+    def close(self):
+        self.file.close()
+
+
+def encoding_report(pages):
+    return [
+        {key: value for key, value in page.items() if key != "data"} | {"bytes": len(page["data"])}
+        for page in pages
+    ]
+
+
+def extract_page_texts(pdf_reader):
+    with span("pdf_to_text"):
+        return [page.extract_text() or "" for page in pdf_reader.pages]
+
+
+def format_page_texts(page_texts, first_page=1):
+    text_content = []
+    for page_num, page_text in enumerate(page_texts, start=first_page):
+        if page_text:
+            text_content.append(f"=== Page {page_num} ===\n{page_text}")
 
     return "\n\n".join(text_content)
 
 
-def pdf_to_images_and_text(pdf_path):
-    encoded_images = pdf_to_images(pdf_path)
-    text_content = pdf_to_text(pdf_path)
+def extract_text(pdf_reader):
+    return format_page_texts(extract_page_texts(pdf_reader))
+
+
+def load_document(source):
+    # Returns (pdf_data, page_texts); rendering later only needs the raw bytes.
+    pdf_data, pdf_reader = load_pdf(source)
+    return pdf_data, extract_page_texts(pdf_reader)
+
+
+def pdf_to_images(source, mode=None, workers=None):
+    pdf_data, pdf_reader = load_pdf(source)
+    return render_pages(pdf_data, len(pdf_reader.pages), mode=mode, workers=workers)
+
+
+def pdf_to_text(source):
+    _, pdf_reader = load_pdf(source)
+    return extract_text(pdf_reader)
+
+
+def pdf_to_images_and_text(source):
+    pdf_data, pdf_reader = load_pdf(source)
+    encoded_images = render_pages(pdf_data, len(pdf_reader.pages))
+    text_content = extract_text(pdf_reader)
     return encoded_images, text_content
 
 
@@ -0,0 +1,353 @@
+import asyncio
+import contextvars
+import os
+import random
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from anthropic import APIConnectionError, APIStatusError
+from utils.common_utils import env_flag
+from utils.telemetry_utils import metrics, record
+
+
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "300"))  # seconds per order, all attempts included
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "4"))
+LLM_RETRY_BASE = float(os.getenv("LLM_RETRY_BASE", "1.0"))
+LLM_RETRY_MAX = float(os.getenv("LLM_RETRY_MAX", "30"))
+LLM_HEDGE = env_flag("LLM_HEDGE")
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+LLM_HEDGE_MAX_SHARE = float(os.getenv("LLM_HEDGE_MAX_SHARE", "0.05"))  # hedges per call, at most
+LLM_MAX_CONTINUATIONS = int(os.getenv("LLM_MAX_CONTINUATIONS", "2"))
+HEDGE_MIN_SAMPLES = 20  # no hedging until this many latencies were seen for a size class
+HEDGE_WORKERS = 16
+
+_deadline = contextvars.ContextVar("order_deadline", default=None)
+_counts = contextvars.ContextVar("request_counts", default=None)
+_counts_lock = threading.Lock()  # chunk requests of one order run on several threads
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+@contextmanager
+def order_deadline(seconds=LLM_DEADLINE):
+    # Every request of the order shares one deadline; nested calls keep the outer one.
+    if _deadline.get() is not None:
+        yield
+        return
+    deadline_token = _deadline.set(time.monotonic() + seconds)
+    counts_token = _counts.set({"retries": 0, "hedges": 0, "hedge_wins": 0, "continuations": 0})
+    try:
+        yield
+    finally:
+        try:
+            _deadline.reset(deadline_token)
+            _counts.reset(counts_token)
+        except ValueError:
+            # A generator closed from another context; nothing is left to restore.
+            pass
+
+
+def remaining():
+    deadline = _deadline.get()
+    if deadline is None:
+        return LLM_DEADLINE
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceeded("Order deadline exceeded")
+    return left
+
+
+def count(name):
+    counts = _counts.get()
+    if counts is not None:
+        with _counts_lock:
+            counts[name] += 1
+            record(**{f"llm_{name}": counts[name]})
+
+
+def size_class(request):
+    # One model serves one-page orders and 40-page chunk windows alike, so latencies are
+    # only compared between requests of similar size: same max_tokens, input length within
+    # a power of two.
+    chars = 0
+    for message in request["messages"]:
+        content = message["content"]
+        for block in [content] if isinstance(content, str) else content:
+            if isinstance(block, str):
+                chars += len(block)
+            else:
+                chars += len(block.get("text", "")) + len(block.get("source", {}).get("data", ""))
+    return request["model"], request.get("max_tokens"), chars.bit_length()
+
+
+class LatencyWindow:
+    # Recent successful call latencies per size class; the hedge delay is their percentile.
+    # Also keeps the hedge budget: at most LLM_HEDGE_MAX_SHARE of all calls are hedged.
+
+    def __init__(self, size=200):
+        self.size = size
+        self.calls = 0
+        self.hedges = 0
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, seconds):
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=self.size)).append(seconds)
+
+    def percentile(self, key, share=LLM_HEDGE_PERCENTILE):
+        with self._lock:
+            self.calls += 1
+            samples = sorted(self._samples.get(key, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * share))]
+
+    def take_hedge(self):
+        with self._lock:
+            if self.hedges >= LLM_HEDGE_MAX_SHARE * self.calls:
+                return False
+            self.hedges += 1
+            return True
+
+
+latencies = LatencyWindow()
+hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="llm-hedge")
+
+
+def abort(stream):
+    # Closing a response does not wake a read blocked on it in another thread; shutting
+    # the socket down does, and ends the request, so the API stops generating.
+    network_stream = stream.response.extensions.get("network_stream")
+    sock = network_stream.get_extra_info("socket") if network_stream is not None else None
+    if sock is None:
+        stream.close()
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+class Race:
+    # The two streams of a hedged call. The first to finish aborts the other rather than
+    # leaving it to run (and be billed) to the end.
+
+    def __init__(self):
+        self.winner = None
+        self.won_by = None
+        self._streams = []
+        self._lock = threading.Lock()
+
+    def join(self, stream):
+        with self._lock:
+            self._streams.append(stream)
+            if self.winner is not None:
+                abort(stream)
+
+    def finish(self, name, stream, message):
+        # Returns the winning message, which is this one unless the other stream was first.
+        with self._lock:
+            if self.winner is None:
+                self.winner, self.won_by = message, name
+                for other in self._streams:
+                    if other is not stream:
+                        abort(other)
+            return self.winner
+
+
+def is_retryable(error):
+    if isinstance(error, APIStatusError):
+        return error.status_code in (408, 429) or error.status_code >= 500
+    return isinstance(error, APIConnectionError)  # includes timeouts
+
+
+def retry_delay(attempt, error):
+    # Full jitter on an exponential backoff; a Retry-After header from the API wins.
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return random.uniform(0, min(LLM_RETRY_MAX, LLM_RETRY_BASE * 2 ** attempt))
+
+
+def reason_of(error):
+    return str(error.status_code) if isinstance(error, APIStatusError) else type(error).__name__
+
+
+def call(client, request):
+    start = time.perf_counter()
+    response = client.messages.create(**request, timeout=remaining())
+    latencies.add(size_class(request), time.perf_counter() - start)
+    return response
+
+
+def streamed_call(client, request, race, name):
+    start = time.perf_counter()
+    with client.messages.stream(**request, timeout=remaining()) as stream:
+        race.join(stream)
+        message = stream.get_final_message()
+    winner = race.finish(name, stream, message)
+    if winner is message:
+        latencies.add(size_class(request), time.perf_counter() - start)
+    return winner
+
+
+def hedged_call(client, request):
+    # When the call runs longer than the recent percentile of its size class, a second
+    # identical request is started on the hedge pool and whichever answers first is
+    # returned. The first request stays on the caller's thread; the pool only holds hedges.
+    delay = latencies.percentile(size_class(request)) if LLM_HEDGE else None
+    if delay is None:
+        return call(client, request)
+
+    race, hedges = Race(), []
+
+    def start_hedge():
+        if race.winner is None and latencies.take_hedge():
+            count("hedges")
+            metrics.inc("llm_hedges_total", help_text="Duplicate requests started after the hedge delay")
+            hedges.append(hedge_pool.submit(contextvars.copy_context().run, streamed_call, client, request, race,
+                                            "hedge"))
+
+    timer = threading.Timer(min(delay, remaining()), contextvars.copy_context().run, (start_hedge,))
+    timer.start()
+    try:
+        response = streamed_call(client, request, race, "primary")
+    except Exception:
+        timer.cancel()
+        # Either the hedge answered first and cut this request off, or this request failed
+        # and a hedge that is still running may answer.
+        if race.winner is None and hedges:
+            try:
+                hedges[0].result(timeout=remaining())
+            except Exception:
+                pass
+        if race.winner is None:
+            raise
+        response = race.winner
+    timer.cancel()
+    if race.won_by == "hedge":
+        count("hedge_wins")
+        metrics.inc("llm_hedge_wins_total", help_text="Hedged requests that answered first")
+    return response
+
+
+async def ahedged_call(client, request):
+    key = size_class(request)
+    delay = latencies.percentile(key) if LLM_HEDGE else None
+
+    async def timed():
+        start = time.perf_counter()
+        response = await client.messages.create(**request, timeout=remaining())
+        latencies.add(key, time.perf_counter() - start)
+        return response
+
+    if delay is None:
+        return await timed()
+    primary = asyncio.ensure_future(timed())
+    done, _ = await asyncio.wait([primary], timeout=min(delay, remaining()))
+    if done or not latencies.take_hedge():
+        return await primary
+
+    count("hedges")
+    metrics.inc("llm_hedges_total", help_text="Duplicate requests started after the hedge delay")
+    hedge = asyncio.ensure_future(timed())
+    pending, error = {primary, hedge}, None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=remaining(), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded("Order deadline exceeded")
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        count("hedge_wins")
+                        metrics.inc("llm_hedge_wins_total", help_text="Hedged requests that answered first")
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        # Cancelling the slower request closes its connection, which stops its generation.
+        for task in pending:
+            task.cancel()
+
+
+def retry_wait(attempt, error):
+    # Returns the backoff before the next attempt, or re-raises when out of attempts or time.
+    if not is_retryable(error) or attempt == LLM_MAX_ATTEMPTS - 1:
+        raise error
+    delay = retry_delay(attempt, error)
+    if delay >= remaining():
+        raise error
+    count("retries")
+    metrics.inc("llm_retries_total", help_text="Messages API calls retried", reason=reason_of(error))
+    print(f"Messages API {reason_of(error)}, retrying in {delay:.1f}s (attempt {attempt + 2} of {LLM_MAX_ATTEMPTS})")
+    return delay
+
+
+def continuation(request, response):
+    # The partial answer is sent back as the start of the assistant turn, so the model
+    # carries on where it stopped. The API rejects a prefill ending in whitespace.
+    messages = list(request["messages"])
+    if messages[-1]["role"] == "assistant":
+        messages = messages[:-1]
+    count("continuations")
+    metrics.inc("llm_continuations_total", help_text="Truncated answers continued in a follow-up request")
+    print(f"Answer hit max_tokens after {response.usage.output_tokens} tokens, continuing")
+    return dict(request, messages=messages + [{"role": "assistant", "content": response.content[0].text.rstrip()}])
+
+
+def join(previous, response):
+    # Folds a continuation into one response: all text, summed usage, the last stop reason.
+    response.content[0].text = previous.content[0].text.rstrip() + response.content[0].text
+    for name in ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens"):
+        value = (getattr(previous.usage, name, None) or 0) + (getattr(response.usage, name, None) or 0)
+        setattr(response.usage, name, value)
+    return response
+
+
+def create(client, request, response=None):
+    # messages.create with the order deadline, jittered exponential retry on overload,
+    # 5xx and connection errors, optional hedging and continuation of truncated answers.
+    # A truncated response obtained elsewhere (e.g. streamed) can be passed to be continued.
+    continuations = 0
+    while True:
+        if response is not None:
+            if response.stop_reason != "max_tokens" or continuations == LLM_MAX_CONTINUATIONS:
+                return response
+            request = continuation(request, response)
+            continuations += 1
+        attempt = 0
+        while True:
+            try:
+                part = hedged_call(client, request)
+                break
+            except (APIStatusError, APIConnectionError) as e:
+                time.sleep(retry_wait(attempt, e))
+                attempt += 1
+        response = join(response, part) if response is not None else part
+
+
+async def acreate(client, request, response=None):
+    continuations = 0
+    while True:
+        if response is not None:
+            if response.stop_reason != "max_tokens" or continuations == LLM_MAX_CONTINUATIONS:
+                return response
+            request = continuation(request, response)
+            continuations += 1
+        attempt = 0
+        while True:
+            try:
+                part = await ahedged_call(client, request)
+                break
+            except (APIStatusError, APIConnectionError) as e:
+                await asyncio.sleep(retry_wait(attempt, e))
+                attempt += 1
+        response = join(response, part) if response is not None else part
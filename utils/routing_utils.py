@@ -0,0 +1,71 @@
+import os
+import xml.etree.ElementTree as ET
+from utils.chunk_utils import page_line_counts
+from utils.common_utils import env_flag
+from utils.schema_utils import fix_order_xml
+from utils.template_utils import fingerprint
+from utils.text_utils import MIN_PAGE_CHARS
+
+
+ROUTING = env_flag("ROUTING", True)
+FAST_MODEL = os.getenv("FAST_MODEL", "claude-haiku-4-5-20251001")
+# Documents scoring below this go to FAST_MODEL; see complexity().
+ROUTING_THRESHOLD = float(os.getenv("ROUTING_THRESHOLD", "1.0"))
+ROUTING_LINES = 20  # order lines that on their own make a document complex
+ROUTING_MIN_CONFIDENCE = float(os.getenv("ROUTING_MIN_CONFIDENCE", "0.8"))
+ROW_SLACK = 3
+
+
+def routing_settings():
+    return f"{FAST_MODEL} below {ROUTING_THRESHOLD}, min confidence {ROUTING_MIN_CONFIDENCE}" if ROUTING else "off"
+
+
+def complexity(page_texts):
+    # Returns (score, features). Every page after the first adds 0.25, a page without a
+    # text layer adds 1 (the model has to read the scan), order lines add 1 per
+    # ROUTING_LINES and a known layout takes 0.25 off.
+    kept = [text for text in page_texts if text is not None]
+    lines = sum(page_line_counts(page_texts))
+    scanned = sum(1 for text in kept if len(text.strip()) < MIN_PAGE_CHARS)
+    known = fingerprint("\n".join(kept)) is not None
+    score = 0.25 * max(0, len(kept) - 1) + (1.0 if scanned else 0.0) + lines / ROUTING_LINES - (0.25 if known else 0.0)
+    return score, {"pages": len(kept), "scanned_pages": scanned, "lines": lines, "known_layout": known}
+
+
+def choose_model(page_texts, model):
+    # Returns (model, score) for a single-request order; model is the default (large) one.
+    if not ROUTING:
+        return model, None
+    score, features = complexity(page_texts)
+    chosen = FAST_MODEL if score < ROUTING_THRESHOLD else model
+    print(f"Routing: complexity {score:.2f} ({', '.join(f'{name} {value}' for name, value in features.items())}) -> {chosen}")
+    return chosen, score
+
+
+def output_confidence(root, page_texts):
+    # Share of the expected order lines that came back with an item id and a price.
+    # Rows ending in an amount also match totals, VAT and shipping, hence the slack.
+    # Without a text layer the expected count is unknown and only the fields are checked.
+    orderlines = root.findall("orderline")
+    complete = sum(1 for orderline in orderlines
+                   if (orderline.findtext("item_id") or "").strip()
+                   and (orderline.findtext("price") or "").strip() not in ("", "NVT"))
+    expected = 0
+    if all(text is None or len(text.strip()) >= MIN_PAGE_CHARS for text in page_texts):
+        expected = sum(page_line_counts(page_texts)) - ROW_SLACK
+    return complete / max(len(orderlines), expected, 1)
+
+
+def escalation_reason(xml_output, stop_reason, page_texts):
+    # Returns why a fast-model answer should be redone by the large model, or None.
+    if stop_reason == "max_tokens":
+        return "truncated"
+    try:
+        _, _, errors = fix_order_xml(xml_output)
+    except ET.ParseError:
+        return "invalid_xml"
+    if errors:
+        return "schema_errors"
+    if output_confidence(ET.fromstring(xml_output.strip()), page_texts) < ROUTING_MIN_CONFIDENCE:
+        return "low_confidence"
+    return None
@@ -0,0 +1,369 @@
+import re
+import xml.etree.ElementTree as ET
+from utils.common_utils import env_flag
+from utils.template_utils import SKIP_LINES
+
+
+SCHEMA_REPAIR = env_flag("SCHEMA_REPAIR", True)
+
+DATE = re.compile(r"\d{2}-\d{2}-\d{4}")
+LOOSE_DATE = re.compile(r"(\d{1,2})[-./ ](\d{1,2})[-./ ](\d{4}|\d{2})")
+ISO_DATE = re.compile(r"(\d{4})-(\d{1,2})-(\d{1,2})(?:T.*)?")
+PRICE = re.compile(r"\d+(?:\.\d+)?")
+LOOSE_AMOUNT = re.compile(r"(?:€|EUR)?[ \t]*(\d{1,3}(?:[. ]\d{3})+(?:,\d+)?|\d+(?:[.,]\d+)?)[ \t]*(?:€|EUR)?",
+                          re.IGNORECASE)
+QUANTITY = re.compile(r"\d+")
+LOOSE_QUANTITY = re.compile(r"(\d+(?:[.,]\d+)?)[ \t]*(?:ST|STK|STUKS|PCS|PC|X)?\.?", re.IGNORECASE)
+CUSTOMERID = re.compile(r"\d+|NVT")
+COUNTRY = re.compile(r"[A-Z]{2}")
+COUNTRIES = {
+    "nederland": "NL", "netherlands": "NL", "the netherlands": "NL", "holland": "NL",
+    "belgie": "BE", "belgië": "BE", "belgium": "BE", "belgique": "BE",
+    "duitsland": "DE", "deutschland": "DE", "germany": "DE",
+    "luxemburg": "LU", "luxembourg": "LU", "frankrijk": "FR", "france": "FR",
+}
+YES_NO = {"y": "Y", "yes": "Y", "ja": "Y", "j": "Y", "true": "Y", "n": "N", "no": "N", "nee": "N", "false": "N"}
+SUPPLIERS = ("COPACO", "6010", "NVT")
+SHIPTO_FIELDS = ("name1", "name2", "street", "postalcode", "city", "country")
+ORDERLINE_FIELDS = ("linenumber", "item_id", "quantity", "deliverydate", "price", "item_description")
+DECLARATION = '<?xml version="1.0" standalone="yes"?>\n'
+
+
+def text_of(element):
+    return (element.text or "").strip() if element is not None else ""
+
+
+def find_text_block(parent, tag, qualifier):
+    for block in parent.findall(tag):
+        if text_of(block.find("textqualifier")) == qualifier:
+            return block
+    return None
+
+
+def check_order(root):
+    # Returns one {"field", "value", "message"} dict per broken rule. Fields are
+    # ElementTree paths from the root, with "@name" for attributes.
+    errors = []
+
+    def error(field, value, message):
+        errors.append({"field": field, "value": value, "message": message})
+
+    if root.tag != "XML_order":
+        error(root.tag, None, "root element must be <XML_order>")
+    if root.get("documentsource") != "AIPDF":
+        error("@documentsource", root.get("documentsource"), "must be AIPDF")
+    if not root.get("external_document_id"):
+        error("@external_document_id", root.get("external_document_id"), "order number is missing")
+    if root.get("supplier") not in SUPPLIERS:
+        error("@supplier", root.get("supplier"), f"must be one of {', '.join(SUPPLIERS)}")
+
+    header = root.find("orderheader")
+    if header is None:
+        error("orderheader", None, "<orderheader> is missing")
+    else:
+        if header.get("sender_id") != "X" * 10:
+            error("orderheader@sender_id", header.get("sender_id"), "must be XXXXXXXXXX")
+        if header.get("customer_ordernumber") != root.get("external_document_id"):
+            error("orderheader@customer_ordernumber", header.get("customer_ordernumber"),
+                  "must equal external_document_id")
+        orderdate = header.get("orderdate", "")
+        if orderdate and not DATE.fullmatch(orderdate):
+            error("orderheader@orderdate", orderdate, "date must be DD-MM-YYYY")
+        if header.get("completedelivery", "") not in ("", "Y", "N"):
+            error("orderheader@completedelivery", header.get("completedelivery"), "must be Y, N or empty")
+        deliverydate = header.get("requested_deliverydate", "")
+        if deliverydate != "NVT" and not DATE.fullmatch(deliverydate):
+            error("orderheader@requested_deliverydate", deliverydate, "date must be DD-MM-YYYY or NVT")
+
+        customerid = header.find("Customer/customerid")
+        if customerid is None:
+            error("orderheader/Customer/customerid", None, "<customerid> is missing")
+        elif text_of(customerid) and not CUSTOMERID.fullmatch(text_of(customerid)):
+            error("orderheader/Customer/customerid", customerid.text, "must be digits or NVT")
+
+        address = header.find("ShipTo/adress")
+        if address is None:
+            error("orderheader/ShipTo/adress", None, "<ShipTo><adress> is missing")
+        else:
+            for field in SHIPTO_FIELDS:
+                if field != "name2" and address.find(field) is None:
+                    error(f"orderheader/ShipTo/adress/{field}", None, f"<{field}> is missing")
+            country = text_of(address.find("country"))
+            if country and not COUNTRY.fullmatch(country):
+                error("orderheader/ShipTo/adress/country", country, "must be a 2-letter ISO country code")
+
+        for qualifier in ("ATT", "CFD"):
+            if find_text_block(header, "ordertext", qualifier) is None:
+                error(f"orderheader/ordertext[{qualifier}]", None, f"<ordertext> block {qualifier} is missing")
+
+    for number, orderline in enumerate(root.findall("orderline"), start=1):
+        path = f"orderline[{number}]"
+        for field in ORDERLINE_FIELDS:
+            if orderline.find(field) is None:
+                error(f"{path}/{field}", None, f"<{field}> is missing")
+        if text_of(orderline.find("linenumber")) != str(number):
+            error(f"{path}/linenumber", text_of(orderline.find("linenumber")), f"must be {number}")
+
+        item_id = orderline.find("item_id")
+        if item_id is not None:
+            if not text_of(item_id):
+                error(f"{path}/item_id", item_id.text, "product code is missing")
+            elif re.search(r"\s", text_of(item_id)):
+                error(f"{path}/item_id", item_id.text, "must not contain spaces")
+            if item_id.get("tag") != "MF":
+                error(f"{path}/item_id@tag", item_id.get("tag"), "must be MF")
+        quantity = orderline.find("quantity")
+        if quantity is not None:
+            if not QUANTITY.fullmatch(text_of(quantity)):
+                error(f"{path}/quantity", quantity.text, "must be a whole number")
+            if quantity.get("unit") != "ST":
+                error(f"{path}/quantity@unit", quantity.get("unit"), "must be ST")
+        deliverydate = text_of(orderline.find("deliverydate"))
+        if orderline.find("deliverydate") is not None and deliverydate != "NVT" and not DATE.fullmatch(deliverydate):
+            error(f"{path}/deliverydate", deliverydate, "date must be DD-MM-YYYY or NVT")
+        price = orderline.find("price")
+        if price is not None:
+            if text_of(price) != "NVT" and not PRICE.fullmatch(text_of(price)):
+                error(f"{path}/price", price.text, "unit price must use a dot as decimal separator, or NVT")
+            if price.get("currency") != "EUR":
+                error(f"{path}/price@currency", price.get("currency"), "must be EUR")
+        if orderline.find("item_description") is not None and not text_of(orderline.find("item_description")):
+            error(f"{path}/item_description", None, "description is missing")
+        if SKIP_LINES.search(text_of(orderline.find("item_description"))):
+            error(path, text_of(orderline.find("item_description")), "shipping/levy lines must be skipped")
+        bid = find_text_block(orderline, "orderlinetext", "BID")
+        if bid is None:
+            error(f"{path}/orderlinetext[BID]", None, "<orderlinetext> block BID is missing")
+        elif not text_of(bid.find("text")):
+            error(f"{path}/orderlinetext[BID]", None, "bid number must be set or NVT")
+
+    return errors
+
+
+def normalize_date_value(value):
+    value = value.strip()
+    match = ISO_DATE.fullmatch(value)
+    if match:
+        year, month, day = match.groups()
+    else:
+        match = LOOSE_DATE.fullmatch(value)
+        if not match:
+            return None
+        day, month, year = match.groups()
+        if len(year) == 2:
+            year = f"20{year}"
+    if not (1 <= int(day) <= 31 and 1 <= int(month) <= 12):
+        return None
+    return f"{int(day):02d}-{int(month):02d}-{year}"
+
+
+def normalize_price_value(value):
+    match = LOOSE_AMOUNT.fullmatch(value.strip())
+    if not match:
+        return None
+    amount = match.group(1).replace(" ", "")
+    if "," in amount:
+        amount = amount.replace(".", "").replace(",", ".")
+    elif re.fullmatch(r"\d{1,3}(?:\.\d{3})+", amount):
+        amount = amount.replace(".", "")
+    return f"{float(amount):.2f}"
+
+
+def normalize_quantity_value(value):
+    match = LOOSE_QUANTITY.fullmatch(value.strip())
+    if not match:
+        return None
+    return str(round(float(match.group(1).replace(",", "."))))
+
+
+def ensure_child(parent, tag, order, text=""):
+    # Inserts an empty <tag> at its schema position (given by `order`) when missing.
+    child = parent.find(tag)
+    if child is not None:
+        return child
+    child = ET.Element(tag)
+    child.text = text
+    position = order.index(tag)
+    index = len(parent)
+    for i, sibling in enumerate(parent):
+        if sibling.tag in order and order.index(sibling.tag) > position:
+            index = i
+            break
+    parent.insert(index, child)
+    return child
+
+
+def text_block(tag, qualifier, text=""):
+    block = ET.Element(tag)
+    ET.SubElement(block, "textqualifier").text = qualifier
+    ET.SubElement(block, "text").text = text
+    return block
+
+
+def fix_order(root):
+    # Applies the mechanical repairs in place and returns a description of each one.
+    fixes = []
+
+    def fix(field, old, new):
+        fixes.append(f"{field}: {old!r} -> {new!r}")
+
+    def set_attribute(element, name, value, field):
+        if element.get(name) != value:
+            fix(field, element.get(name), value)
+            element.set(name, value)
+
+    def set_text(element, value, field):
+        if element.text != value:
+            fix(field, element.text, value)
+            element.text = value
+
+    set_attribute(root, "documentsource", "AIPDF", "@documentsource")
+    supplier = (root.get("supplier") or "").strip().upper()
+    if supplier in SUPPLIERS:
+        set_attribute(root, "supplier", supplier, "@supplier")
+
+    header = root.find("orderheader")
+    if header is not None:
+        set_attribute(header, "sender_id", "X" * 10, "orderheader@sender_id")
+        ordernumber = (root.get("external_document_id") or header.get("customer_ordernumber") or "").strip()
+        if ordernumber:
+            set_attribute(root, "external_document_id", ordernumber, "@external_document_id")
+            set_attribute(header, "customer_ordernumber", ordernumber, "orderheader@customer_ordernumber")
+
+        orderdate = header.get("orderdate", "")
+        if orderdate and not DATE.fullmatch(orderdate) and normalize_date_value(orderdate):
+            set_attribute(header, "orderdate", normalize_date_value(orderdate), "orderheader@orderdate")
+        deliverydate = header.get("requested_deliverydate", "").strip()
+        if not deliverydate:
+            set_attribute(header, "requested_deliverydate", "NVT", "orderheader@requested_deliverydate")
+        elif deliverydate != "NVT" and not DATE.fullmatch(deliverydate) and normalize_date_value(deliverydate):
+            set_attribute(header, "requested_deliverydate", normalize_date_value(deliverydate),
+                          "orderheader@requested_deliverydate")
+        completedelivery = header.get("completedelivery", "").strip().lower()
+        if completedelivery in YES_NO:
+            set_attribute(header, "completedelivery", YES_NO[completedelivery], "orderheader@completedelivery")
+
+        header_order = ("Customer", "ShipTo", "ordertext")
+        customer = ensure_child(header, "Customer", header_order)
+        if customer.find("customerid") is None:
+            fix("orderheader/Customer/customerid", None, "")
+            ensure_child(customer, "customerid", ("customerid",))
+        address = ensure_child(ensure_child(header, "ShipTo", header_order), "adress", ("adress",))
+        for field in SHIPTO_FIELDS:
+            if field != "name2" and address.find(field) is None:
+                fix(f"orderheader/ShipTo/adress/{field}", None, "")
+                ensure_child(address, field, SHIPTO_FIELDS)
+        country = address.find("country")
+        name = text_of(country)
+        if name.lower() in COUNTRIES or (COUNTRY.fullmatch(name.upper()) and name != name.upper()):
+            set_text(country, COUNTRIES.get(name.lower(), name.upper()), "orderheader/ShipTo/adress/country")
+
+        for qualifier in ("ATT", "CFD"):
+            if find_text_block(header, "ordertext", qualifier) is None:
+                fix(f"orderheader/ordertext[{qualifier}]", None, "")
+                header.append(text_block("ordertext", qualifier))
+
+    requested = header.get("requested_deliverydate", "NVT") if header is not None else "NVT"
+    number = 0
+    for orderline in root.findall("orderline"):
+        if SKIP_LINES.search(text_of(orderline.find("item_description"))):
+            fix(f"orderline[{number + 1}]", text_of(orderline.find("item_description")), None)
+            root.remove(orderline)
+            continue
+        number += 1
+        path = f"orderline[{number}]"
+        for field in ORDERLINE_FIELDS:
+            if orderline.find(field) is None:
+                fix(f"{path}/{field}", None, "")
+                ensure_child(orderline, field, ORDERLINE_FIELDS + ("orderlinetext", "orderline_info"))
+
+        set_text(orderline.find("linenumber"), str(number), f"{path}/linenumber")
+        item_id = orderline.find("item_id")
+        if re.search(r"\s", text_of(item_id)):
+            set_text(item_id, re.sub(r"\s+", "", item_id.text), f"{path}/item_id")
+        set_attribute(item_id, "tag", "MF", f"{path}/item_id@tag")
+        quantity = orderline.find("quantity")
+        if not QUANTITY.fullmatch(text_of(quantity)) and normalize_quantity_value(text_of(quantity)):
+            set_text(quantity, normalize_quantity_value(text_of(quantity)), f"{path}/quantity")
+        set_attribute(quantity, "unit", "ST", f"{path}/quantity@unit")
+        deliverydate = orderline.find("deliverydate")
+        if not text_of(deliverydate):
+            set_text(deliverydate, requested, f"{path}/deliverydate")
+        elif text_of(deliverydate) != "NVT" and not DATE.fullmatch(text_of(deliverydate)) \
+                and normalize_date_value(text_of(deliverydate)):
+            set_text(deliverydate, normalize_date_value(text_of(deliverydate)), f"{path}/deliverydate")
+        price = orderline.find("price")
+        if not text_of(price):
+            set_text(price, "NVT", f"{path}/price")
+        elif text_of(price) != "NVT" and not PRICE.fullmatch(text_of(price)) and normalize_price_value(text_of(price)):
+            set_text(price, normalize_price_value(text_of(price)), f"{path}/price")
+        set_attribute(price, "currency", "EUR", f"{path}/price@currency")
+
+        bid = find_text_block(orderline, "orderlinetext", "BID")
+        if bid is None:
+            fix(f"{path}/orderlinetext[BID]", None, "NVT")
+            orderline.insert(list(orderline).index(orderline.find("item_description")) + 1,
+                             text_block("orderlinetext", "BID", "NVT"))
+        elif not text_of(bid.find("text")):
+            set_text(ensure_child(bid, "text", ("textqualifier", "text")), "NVT", f"{path}/orderlinetext[BID]")
+
+    return fixes
+
+
+def serialize(root):
+    ET.indent(root)
+    return DECLARATION + ET.tostring(root, encoding="unicode", short_empty_elements=False)
+
+
+def fix_order_xml(xml_string):
+    # Returns (xml, fixes, errors): the mechanically repaired document, the repairs that
+    # were made and the rule violations that remain. Raises ET.ParseError on malformed XML.
+    root = ET.fromstring(xml_string.strip())
+    fixes = fix_order(root)
+    return (serialize(root) if fixes else xml_string), fixes, check_order(root)
+
+
+def locate(root, field):
+    # Resolves an error path to (element, attribute); attribute is None for element text.
+    path, _, attribute = field.partition("@")
+    match = re.fullmatch(r"(.*?)/?(ordertext|orderlinetext)\[([A-Z]+)\]", path)
+    if match:
+        parent = root.find(match.group(1)) if match.group(1) else root
+        block = find_text_block(parent, match.group(2), match.group(3)) if parent is not None else None
+        return (block.find("text") if block is not None else None), None
+    element = root.find(path) if path else root
+    return element, attribute or None
+
+
+def apply_fixes(xml_string, fixes_xml, fields):
+    # Applies a <fixes><fix field="...">value</fix></fixes> answer to the listed fields only.
+    root = ET.fromstring(xml_string.strip())
+    start, end = fixes_xml.find("<fixes"), fixes_xml.rfind("</fixes>")
+    if start < 0 or end < 0:
+        raise ET.ParseError("Repair answer contains no <fixes> block")
+    applied = []
+    for item in ET.fromstring(fixes_xml[start:end + len("</fixes>")]).iter("fix"):
+        field = item.get("field", "")
+        if field not in fields:
+            continue
+        element, attribute = locate(root, field)
+        if element is None:
+            continue
+        value = (item.text or "").strip()
+        if attribute:
+            element.set(attribute, value)
+        else:
+            element.text = value
+        applied.append(field)
+    return serialize(root), applied
+
+
+def error_context(xml_string, errors):
+    # The document without the order lines that have no errors, to keep repair requests small.
+    root = ET.fromstring(xml_string.strip())
+    failing = {int(match.group(1)) for error in errors for match in [re.match(r"orderline\[(\d+)\]", error["field"])]
+               if match}
+    for number, orderline in enumerate(root.findall("orderline"), start=1):
+        if number not in failing:
+            root.remove(orderline)
+    return serialize(root)
@@ -1,12 +1,15 @@
-import requests
+import streamlit as st
 import base64
 from io import BytesIO
-from PIL import Image
 import os
 from pathlib import Path
 
 
 def load_image_from_web(url):
+    # Imported here: requests and Pillow are only needed for remote icons.
+    import requests
+    from PIL import Image
+
     response = requests.get(url)
     img = Image.open(BytesIO(response.content))
 
@@ -18,7 +21,9 @@ def load_image_from_web(url):
     return data_uri
 
 
+@st.cache_data(show_spinner=False)
 def load_local_image(image_path):
+    # Streamlit reruns the script on every interaction; the icons are encoded once per process.
     if os.path.exists(image_path):
         with open(image_path, "rb") as img_file:
             img_data = img_file.read()
@@ -33,3 +38,17 @@ def load_local_image(image_path):
                 mime_type = 'image/png'  # default to png
             return f"data:{mime_type};base64,{img_b64}"
     return None
+
+
+def show_timing_breakdown(trace):
+    with st.sidebar.expander("⏱️ Timing breakdown", expanded=False):
+        st.caption(f"Total {trace['seconds']:.2f}s · {trace.get('outcome', 'error' if 'error' in trace else 'unknown')}")
+        st.dataframe(
+            [{"stage": item["name"], "seconds": round(item["seconds"], 3)} for item in trace["spans"]],
+            hide_index=True
+        )
+        details = {key: trace[key] for key in (
+            "pages", "pages_rendered", "payload_bytes", "image_tokens", "input_tokens", "output_tokens",
+            "cache_read_input_tokens", "time_to_first_token", "stop_reason", "model"
+        ) if key in trace}
+        st.json(details, expanded=False)
@@ -0,0 +1,231 @@
+import bisect
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+METRICS_FILE = os.getenv("METRICS_FILE", "metrics.prom")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+TELEMETRY_LOG = os.getenv("TELEMETRY_LOG")  # JSON-lines file; stderr when unset
+
+SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+logger = logging.getLogger("order_telemetry")
+logger.propagate = False
+if not logger.handlers:
+    logger.addHandler(logging.FileHandler(TELEMETRY_LOG, encoding="utf-8") if TELEMETRY_LOG else logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+
+_current_trace = contextvars.ContextVar("order_trace", default=None)
+recent_traces = deque(maxlen=100)
+
+
+class Metrics:
+    # Minimal Prometheus registry: counters and fixed-bucket histograms with labels.
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.help = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, help_text="", **labels):
+        with self._lock:
+            self.help.setdefault(name, help_text)
+            key = self._key(name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, help_text="", **labels):
+        with self._lock:
+            self.help.setdefault(name, help_text)
+            key = self._key(name, labels)
+            histogram = self.histograms.setdefault(key, {"buckets": buckets, "counts": [0] * len(buckets),
+                                                         "sum": 0.0, "count": 0})
+            index = bisect.bisect_left(histogram["buckets"], value)
+            if index < len(histogram["counts"]):
+                histogram["counts"][index] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def value(self, name, **labels):
+        with self._lock:
+            return self.counters.get(self._key(name, labels), 0)
+
+    def render(self):
+        def label_text(labels, extra=()):
+            pairs = [*labels, *extra]
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+        lines = []
+        with self._lock:
+            for name in sorted({key[0] for key in self.counters}):
+                lines += [f"# HELP {name} {self.help.get(name, '')}", f"# TYPE {name} counter"]
+                lines += [f"{name}{label_text(labels)} {value}"
+                          for (metric, labels), value in sorted(self.counters.items()) if metric == name]
+            for name in sorted({key[0] for key in self.histograms}):
+                lines += [f"# HELP {name} {self.help.get(name, '')}", f"# TYPE {name} histogram"]
+                for (metric, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram["buckets"], histogram["counts"]):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{label_text(labels, [('le', bound)])} {cumulative}")
+                    lines.append(f"{name}_bucket{label_text(labels, [('le', '+Inf')])} {histogram['count']}")
+                    lines.append(f"{name}_sum{label_text(labels)} {histogram['sum']}")
+                    lines.append(f"{name}_count{label_text(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path=METRICS_FILE):
+        # Written atomically so a node_exporter textfile collector never reads half a file.
+        if not path:
+            return
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            file.write(self.render())
+        os.replace(tmp_path, path)
+
+
+metrics = Metrics()
+
+
+class Trace:
+
+    def __init__(self, **attributes):
+        self.trace_id = uuid.uuid4().hex
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.seconds = None
+        self.attributes = dict(attributes)
+        self.spans = []
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "started_at": self.started_at,
+            "seconds": self.seconds,
+            **self.attributes,
+            "spans": list(self.spans),
+        }
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def trace_order(**attributes):
+    # Opens the per-order trace. Nested calls (e.g. main.py around process()) reuse
+    # the outer trace, which is the one that gets emitted.
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.attributes.update(attributes)
+        yield trace
+        return
+
+    trace = Trace(**attributes)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    except BaseException as e:
+        trace.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        try:
+            _current_trace.reset(token)
+        except ValueError:
+            # A generator closed from another context; the trace is finished regardless.
+            _current_trace.set(None)
+        trace.seconds = time.perf_counter() - trace.start
+        emit(trace)
+
+
+@contextmanager
+def span(name):
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.spans.append({"name": name, "offset": start - trace.start, "seconds": time.perf_counter() - start})
+
+
+def record(**attributes):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.attributes.update(attributes)
+
+
+def emit(trace):
+    data = trace.to_dict()
+    recent_traces.append(data)
+    logger.info(json.dumps(data, default=str))
+
+    outcome = "error" if "error" in data else data.get("outcome", "unknown")
+    metrics.inc("order_requests_total", help_text="Processed orders by outcome", outcome=outcome)
+    metrics.observe("order_duration_seconds", trace.seconds, help_text="End-to-end order processing time")
+    for item in data["spans"]:
+        metrics.observe("order_stage_duration_seconds", item["seconds"],
+                        help_text="Time spent per pipeline stage", stage=item["name"])
+    for key in ("pages", "pages_rendered", "pages_skipped", "payload_bytes", "schema_fixes", "schema_errors",
+                "catalog_fills", "catalog_mismatches"):
+        if key in data:
+            metrics.inc(f"order_{key}_total", data[key], help_text=f"Sum of {key.replace('_', ' ')} over all orders")
+    for key in ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens"):
+        if key in data:
+            metrics.inc("llm_tokens_total", data[key], help_text="Tokens reported by the Messages API", type=key)
+    if "route" in data:
+        metrics.inc("llm_route_total", help_text="Single-request orders by routed model", route=data["route"])
+    if "escalated" in data:
+        metrics.inc("llm_escalations_total", help_text="Fast-model answers redone by the large model",
+                    reason=data["escalated"])
+    if "stop_reason" in data:
+        metrics.inc("llm_stop_reason_total", help_text="Messages API stop reasons", reason=data["stop_reason"])
+
+    try:
+        metrics.write()
+    except OSError as e:
+        logger.warning(f"Could not write metrics file: {e}")
+
+
+def start_metrics_server(port=METRICS_PORT, host="0.0.0.0"):
+    # Serves the registry at /metrics for Prometheus to scrape. Returns None when disabled.
+    if not port:
+        return None
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            data = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,179 @@
+import json
+import os
+import re
+from utils.common_utils import env_flag
+from utils.pdf_utils import format_page_texts
+from utils.text_utils import MIN_PAGE_CHARS
+from utils.xml_utils import build_order_xml
+
+
+TEMPLATE_ENGINE = env_flag("TEMPLATE_ENGINE", True)
+TEMPLATE_FILE = os.getenv("TEMPLATE_FILE", "templates.json")
+TEMPLATE_MIN_CONFIDENCE = float(os.getenv("TEMPLATE_MIN_CONFIDENCE", "0.95"))
+
+DATE = r"\d{1,2}[-./]\d{1,2}[-./](?:\d{4}|\d{2})"
+AMOUNT = r"-?\d{1,3}(?:\.\d{3})*,\d{2}|-?\d+,\d{2}|-?\d+\.\d{2}"
+
+# Each template describes one sender layout. "anchors" fingerprint the layout (all must
+# occur in the text), "fields" capture header values, "shipto" captures the delivery
+# address block and "line" matches one order-line row of the item table.
+DEFAULT_TEMPLATES = [
+    {
+        "name": "nl_erp_bestelling",
+        "anchors": ["Bestelnummer:", "Besteldatum:", "Afleveradres:", "Omschrijving", "Aantal", "Prijs"],
+        "fields": {
+            "customer_ordernumber": r"Bestelnummer:[ \t]*(\S[^\n]*?)[ \t]*$",
+            "orderdate": rf"Besteldatum:[ \t]*({DATE})",
+            "requested_deliverydate": rf"Leverdatum:[ \t]*({DATE})",
+            "recipientsreference": r"Referentie:[ \t]*(\S[^\n]*?)[ \t]*$",
+            "customerid": r"(?:Klantnummer|Debiteurnummer|Klantnr\.?):[ \t]*(\d+)",
+        },
+        "shipto": (r"Afleveradres:[ \t]*\n(?P<name1>[^\n]+)\n(?:T\.a\.v\.:?[ \t]*(?P<name2>[^\n]+)\n)?"
+                   r"(?P<street>[^\n]+)\n(?P<postalcode>\d{4}(?:[ \t]?[A-Z]{2}\b)?)[ \t]+(?P<city>[^\n]+)"),
+        "table_start": r"^Code\b.*\bOmschrijving\b.*\bAantal\b.*\bPrijs\b",
+        "table_end": r"^(?:Subtotaal|Totaal|Total)\b",
+        "line": (rf"^(?P<item_id>\S+)[ \t]+(?P<item_description>.+?)[ \t]+(?P<quantity>\d+(?:,\d+)?)"
+                 rf"[ \t]+(?:€[ \t]*)?(?P<price>{AMOUNT})[ \t]+(?:€[ \t]*)?(?:{AMOUNT})[ \t]*$"),
+    },
+]
+
+SKIP_LINES = re.compile(r"thuiskopieheffing|verzendkosten|shipping costs|transport", re.IGNORECASE)
+BID = re.compile(r"\b(?:BID|PGO)\b[ \t:#-]*([A-Z0-9][A-Z0-9-]*)", re.IGNORECASE)
+REQUIRED_FIELDS = ("customer_ordernumber", "orderdate")
+REQUIRED_SHIPTO = ("name1", "street", "postalcode", "city")
+
+
+def compile_template(spec):
+    flags = re.MULTILINE
+    return {
+        "name": spec["name"],
+        "anchors": spec["anchors"],
+        "fields": {name: re.compile(pattern, flags) for name, pattern in spec["fields"].items()},
+        "shipto": re.compile(spec["shipto"], flags),
+        "table_start": re.compile(spec["table_start"], flags | re.IGNORECASE),
+        "table_end": re.compile(spec["table_end"], flags | re.IGNORECASE),
+        "line": re.compile(spec["line"]),
+    }
+
+
+def load_templates(path=TEMPLATE_FILE):
+    specs = list(DEFAULT_TEMPLATES)
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as file:
+            specs.extend(json.load(file))
+    return [compile_template(spec) for spec in specs]
+
+
+templates = load_templates()
+
+
+def fingerprint(text):
+    # Returns the template whose anchors all occur in the text, or None.
+    for template in templates:
+        if all(anchor in text for anchor in template["anchors"]):
+            return template
+    return None
+
+
+def normalize_date(value):
+    day, month, year = re.split(r"[-./]", value)
+    if len(year) == 2:
+        year = f"20{year}"
+    return f"{int(day):02d}-{int(month):02d}-{year}"
+
+
+def normalize_amount(value):
+    if "," in value:
+        value = value.replace(".", "").replace(",", ".")
+    return f"{float(value):.2f}"
+
+
+def detect_supplier(text):
+    if re.search(r"Copaco\s+(?:Belgi[eë]|Belgium|NV)\b", text, re.IGNORECASE):
+        return "6010"
+    if re.search(r"Copaco\s+(?:Nederland|The Netherlands)\b", text, re.IGNORECASE):
+        return "COPACO"
+    return "NVT"
+
+
+def detect_country(postalcode):
+    return "NL" if re.fullmatch(r"\d{4}[ \t]?[A-Z]{2}", postalcode) else "BE"
+
+
+def table_rows(template, text):
+    start = template["table_start"].search(text)
+    if start is None:
+        return []
+    end = template["table_end"].search(text, start.end())
+    body = text[start.end():end.start() if end else len(text)]
+    return [row.strip() for row in body.splitlines() if row.strip()]
+
+
+def extract_order(page_texts, email_text=None):
+    # Returns (order, confidence, template_name) or None when no template matches.
+    text = format_page_texts(page_texts)
+    template = fingerprint(text)
+    if template is None:
+        return None
+
+    order, found = {}, 0
+    sources = [text, email_text or ""]
+    for name, pattern in template["fields"].items():
+        match = next((m for m in (pattern.search(source) for source in sources) if m), None)
+        if match:
+            order[name] = match.group(1).strip()
+            found += name in REQUIRED_FIELDS
+    for name in ("orderdate", "requested_deliverydate"):
+        if name in order:
+            order[name] = normalize_date(order[name])
+    order.setdefault("requested_deliverydate", "NVT")
+    order["supplier"] = detect_supplier("\n".join(sources))
+
+    shipto = template["shipto"].search(text)
+    if shipto:
+        order["shipto"] = {name: value.strip() for name, value in shipto.groupdict().items() if value}
+        order["shipto"]["country"] = detect_country(order["shipto"]["postalcode"])
+        found += sum(1 for name in REQUIRED_SHIPTO if order["shipto"].get(name))
+
+    lines, unmatched = [], 0
+    for row in table_rows(template, text):
+        if SKIP_LINES.search(row):
+            continue
+        match = template["line"].match(row)
+        if match is None:
+            # Rows with an amount in them look like order lines we failed to read.
+            unmatched += bool(re.search(AMOUNT, row))
+            continue
+        bid = BID.search(row)
+        lines.append({
+            "item_id": match["item_id"].replace(" ", ""),
+            "item_description": match["item_description"].strip(),
+            "quantity": str(round(float(match["quantity"].replace(",", ".")))),
+            "price": normalize_amount(match["price"]),
+            "deliverydate": order["requested_deliverydate"],
+            "bid": bid.group(1) if bid and "BIDREF" not in row.upper() else "NVT",
+        })
+    order["lines"] = lines
+
+    required = len(REQUIRED_FIELDS) + len(REQUIRED_SHIPTO)
+    confidence = found / required
+    confidence *= len(lines) / (len(lines) + unmatched) if lines else 0.0
+    # Lines on scanned pages are invisible to the patterns, so pages without a
+    # usable text layer count against the extraction.
+    confidence *= sum(1 for page_text in page_texts if len(page_text.strip()) >= MIN_PAGE_CHARS) / len(page_texts)
+    return order, confidence, template["name"]
+
+
+def match_template(page_texts, email_text=None):
+    # Returns the <XML_order> document for a known layout, or None when the document
+    # is unknown or the extraction is not confident enough to skip the LLM.
+    if not TEMPLATE_ENGINE:
+        return None
+    result = extract_order(page_texts, email_text)
+    if result is None:
+        return None
+    order, confidence, name = result
+    print(f"Template {name}: confidence {confidence:.2f}")
+    if confidence < TEMPLATE_MIN_CONFIDENCE:
+        return None
+    return build_order_xml(order)
@@ -0,0 +1,67 @@
+import os
+import re
+import unicodedata
+from utils.common_utils import env_flag
+
+
+TEXT_FAST_PATH = env_flag("TEXT_FAST_PATH", True)
+TEXT_QUALITY_THRESHOLD = float(os.getenv("TEXT_QUALITY_THRESHOLD", "0.85"))
+MIN_PAGE_CHARS = 40
+
+# UTF-8 accented characters decoded as cp1252/latin-1, e.g. "Ã©" for "é".
+MOJIBAKE = re.compile(r"Ã[\u0080-¿]|â€|Â[ -¿]")
+# Accents extracted as separate spacing marks, e.g. "Sacre`straat" or "e ´".
+DETACHED_ACCENT = re.compile(r"[A-Za-z]\s?[`´¨^˜]|[`´¨^˜]\s?[A-Za-z]")
+CID_GLYPH = re.compile(r"\(cid:\d+\)")
+NUMBER = re.compile(r"\d+(?:[.,]\d+)*")
+TABLE_HEADER = re.compile(r"\b(aantal|prijs|bedrag|qty|quantity|price|amount|omschrijving|description)\b", re.IGNORECASE)
+# Letter-spaced extraction such as "B e s t e l n u m m e r".
+SPACED_LETTERS = re.compile(r"(?:\b\w ){4,}\w\b")
+
+
+def unreadable_ratio(text):
+    bad = len(CID_GLYPH.findall(text))
+    for char in CID_GLYPH.sub("", text):
+        category = unicodedata.category(char)
+        if char == "�" or category in ("Co", "Cn") or (category == "Cc" and char not in "\n\t\r"):
+            bad += 1
+    return bad / max(1, len(text))
+
+
+def table_structure(lines):
+    # A page that announces an order table should have rows with several numeric columns.
+    if not any(TABLE_HEADER.search(line) for line in lines):
+        return 1.0
+    numeric_rows = sum(1 for line in lines if len(NUMBER.findall(line)) >= 2)
+    return 1.0 if numeric_rows else 0.3
+
+
+def score_page_text(text):
+    # Returns (score, details); score is in [0, 1] and higher means the text layer
+    # can be trusted without a rendered image of the page.
+    text = text or ""
+    stripped = "".join(text.split())
+    if len(stripped) < MIN_PAGE_CHARS:
+        return 0.0, {"chars": len(stripped), "reason": "no usable text layer"}
+
+    lines = [line for line in text.splitlines() if line.strip()]
+    words = text.split()
+    details = {
+        "chars": len(stripped),
+        "coverage": min(1.0, len(stripped) / 120),
+        "unreadable": unreadable_ratio(text),
+        "mojibake": len(MOJIBAKE.findall(text)),
+        "detached_accents": len(DETACHED_ACCENT.findall(text)),
+        "spaced_letters": len(SPACED_LETTERS.findall(text)),
+        "table": table_structure(lines),
+        "single_char_words": sum(1 for word in words if len(word) == 1) / max(1, len(words)),
+    }
+
+    score = details["coverage"] * details["table"]
+    score *= max(0.0, 1.0 - 20 * details["unreadable"])
+    score *= 0.5 ** min(4, details["mojibake"])
+    score *= 0.7 ** min(4, details["detached_accents"])
+    score *= 0.6 ** min(4, details["spaced_letters"])
+    if details["single_char_words"] > 0.3:
+        score *= 0.5
+    return score, details
@@ -1,18 +1,43 @@
+import codecs
+import re
 import xml.etree.ElementTree as ET
+import zipfile
+from collections import Counter
+from io import BytesIO
+from pathlib import PurePath
 
 
-def read_xml_file(xml_path: str) -> str:
-    encodings = ['utf-8', 'utf-16', 'latin-1', 'cp1252']
-    for encoding in encodings:
-        try:
-            with open(xml_path, 'r', encoding=encoding) as file:
-                return file.read()
-        except UnicodeDecodeError:
-            continue
+XML_DECLARATION = re.compile(rb"""^<\?xml[^>]*?encoding\s*=\s*["']([A-Za-z0-9._-]+)["']""")
+
+
+def detect_xml_encoding(head: bytes) -> str | None:
+    # Encoding from the BOM or the XML declaration in the first bytes of a document;
+    # None when neither names one.
+    for bom, encoding in ((codecs.BOM_UTF32_LE, "utf-32"), (codecs.BOM_UTF32_BE, "utf-32"),
+                          (codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF16_LE, "utf-16"),
+                          (codecs.BOM_UTF16_BE, "utf-16")):
+        if head.startswith(bom):
+            return encoding
+    if head.startswith(b"<\x00?\x00"):
+        return "utf-16-le"
+    if head.startswith(b"\x00<\x00?"):
+        return "utf-16-be"
+    match = XML_DECLARATION.match(head)
+    return match.group(1).decode("ascii").lower() if match else None
+
 
+def read_xml_file(xml_path: str) -> str:
+    # Decodes once with the declared encoding. Undeclared files are UTF-8 by the XML spec,
+    # but exports from older Windows tools often are cp1252, which decodes any byte.
     with open(xml_path, 'rb') as file:
         content = file.read()
-        return content.decode('utf-8', errors='ignore')
+    encoding = detect_xml_encoding(content[:256])
+    if encoding is not None:
+        return content.decode(encoding, errors='replace')
+    try:
+        return content.decode('utf-8')
+    except UnicodeDecodeError:
+        return content.decode('cp1252', errors='replace')
 
 
 def validate_xml(xml_string: str) -> bool:
@@ -24,7 +49,155 @@ def validate_xml(xml_string: str) -> bool:
         return False
 
 
+class IncrementalXMLValidator:
+    # Checks a streamed document chunk by chunk so that bad output can be rejected
+    # before the rest of it is generated.
+
+    def __init__(self):
+        self.parser = ET.XMLPullParser(events=("end",))
+        self.prefix = ""
+        self.started = False
+
+    def feed(self, chunk: str) -> None:
+        if not self.started:
+            self.prefix += chunk
+            head = self.prefix.lstrip()
+            if not head:
+                return
+            if not (head.startswith("<?xml") or "<?xml".startswith(head)):
+                raise ET.ParseError(f"Output does not start with <?xml: {head[:40]!r}")
+            if len(head) < len("<?xml"):
+                return
+            self.started = True
+            chunk = head
+
+        self.parser.feed(chunk)
+        for _ in self.parser.read_events():
+            pass
+
+    def close(self) -> None:
+        if not self.started:
+            raise ET.ParseError("Output contains no XML")
+        self.parser.close()
+
+
+def build_order_xml(order: dict) -> str:
+    # Serializes an order dict into the <XML_order> schema described in llm_utils.PROMPT.
+    root = ET.Element("XML_order", {
+        "documentsource": "AIPDF",
+        "external_document_id": order.get("customer_ordernumber", ""),
+        "supplier": order.get("supplier", "NVT"),
+    })
+    header = ET.SubElement(root, "orderheader", {
+        "sender_id": "XXXXXXXXXX",
+        "customer_ordernumber": order.get("customer_ordernumber", ""),
+        "orderdate": order.get("orderdate", ""),
+        "completedelivery": order.get("completedelivery", ""),
+        "requested_deliverydate": order.get("requested_deliverydate", "NVT"),
+        "recipientsreference": order.get("recipientsreference", ""),
+    })
+    ET.SubElement(ET.SubElement(header, "Customer"), "customerid").text = order.get("customerid", "")
+
+    address = ET.SubElement(ET.SubElement(header, "ShipTo"), "adress")
+    shipto = order.get("shipto", {})
+    for field in ("name1", "name2", "street", "postalcode", "city", "country"):
+        if field != "name2" or shipto.get(field):
+            ET.SubElement(address, field).text = shipto.get(field, "")
+
+    for qualifier in ("ATT", "CFD"):
+        ordertext = ET.SubElement(header, "ordertext")
+        ET.SubElement(ordertext, "textqualifier").text = qualifier
+        ET.SubElement(ordertext, "text").text = order.get(qualifier.lower(), "")
+
+    for linenumber, line in enumerate(order.get("lines", []), start=1):
+        orderline = ET.SubElement(root, "orderline")
+        ET.SubElement(orderline, "linenumber").text = str(linenumber)
+        ET.SubElement(orderline, "item_id", {"tag": "MF"}).text = line.get("item_id", "")
+        ET.SubElement(orderline, "quantity", {"unit": "ST"}).text = line.get("quantity", "")
+        ET.SubElement(orderline, "deliverydate").text = line.get("deliverydate", order.get("requested_deliverydate", "NVT"))
+        ET.SubElement(orderline, "price", {"currency": "EUR"}).text = line.get("price", "NVT")
+        ET.SubElement(orderline, "item_description").text = line.get("item_description", "")
+        orderlinetext = ET.SubElement(orderline, "orderlinetext")
+        ET.SubElement(orderlinetext, "textqualifier").text = "BID"
+        ET.SubElement(orderlinetext, "text").text = line.get("bid", "NVT")
+        end_user = line.get("end_user")
+        if end_user:
+            info = ET.SubElement(ET.SubElement(orderline, "orderline_info"), "end-user_orderline_info")
+            for field in ("name1", "street", "postalcode", "city", "country"):
+                ET.SubElement(info, f"end-user_orderline_{field}").text = end_user.get(field, "")
+
+    ET.indent(root)
+    return '<?xml version="1.0" standalone="yes"?>\n' + ET.tostring(root, encoding="unicode", short_empty_elements=False)
+
+
+def orderline_key(orderline: ET.Element) -> tuple:
+    values = [orderline.findtext(tag) for tag in ("item_id", "quantity", "price", "item_description", "deliverydate")]
+    values += [text.findtext("text") for text in orderline.findall("orderlinetext")
+               if (text.findtext("textqualifier") or "").strip() == "BID"]
+    return tuple(" ".join((value or "").split()).lower() for value in values)
+
+
+def merge_order_xml(header_xml: str, window_xmls, windows, page_rows=None) -> str:
+    # Combines a header-only <XML_order> with the order lines extracted per page window
+    # (windows are the (first, last) pages of each window_xml). Only pages shared with the
+    # previous window are sent twice, so only their lines are deduplicated: they end the
+    # previous window and start the next one. page_rows (estimated order lines per page)
+    # bounds how many lines that is. Lines are renumbered and empty delivery dates fall
+    # back to the header's requested_deliverydate. Raises ET.ParseError on bad input.
+    root = ET.fromstring(header_xml.strip())
+    for orderline in root.findall("orderline"):
+        root.remove(orderline)
+    header = root.find("orderheader")
+    default_date = header.get("requested_deliverydate", "NVT") if header is not None else "NVT"
+
+    previous, previous_last, linenumber = [], 0, 0
+    for (first, last), window_xml in zip(windows, window_xmls, strict=True):
+        orderlines = list(ET.fromstring(window_xml.strip()).iter("orderline"))
+        for orderline in orderlines:
+            deliverydate = orderline.find("deliverydate")
+            if deliverydate is not None and not (deliverydate.text or "").strip():
+                deliverydate.text = default_date
+
+        shared = range(first, min(last, previous_last) + 1)
+        limit = 0
+        if shared:
+            limit = sum(page_rows[page - 1] for page in shared) if page_rows else len(orderlines)
+        repeated = Counter(orderline_key(orderline) for orderline in previous[max(0, len(previous) - limit):])
+
+        for index, orderline in enumerate(orderlines):
+            key = orderline_key(orderline)
+            if index < limit and repeated[key]:
+                repeated[key] -= 1
+                continue
+            linenumber += 1
+            number = orderline.find("linenumber")
+            if number is None:
+                number = ET.Element("linenumber")
+                orderline.insert(0, number)
+            number.text = str(linenumber)
+            root.append(orderline)
+        previous, previous_last = orderlines, last
+
+    ET.indent(root)
+    return '<?xml version="1.0" standalone="yes"?>\n' + ET.tostring(root, encoding="unicode", short_empty_elements=False)
+
+
 def save_xml(xml_string: str, output_path: str) -> None:
     with open(output_path, 'w', encoding='utf-8') as f:
         f.write(xml_string)
     print(f"XML saved to: {output_path}")
+
+
+def zip_xml_files(files) -> bytes:
+    # files: iterable of (filename, xml_string); repeated names get a numeric suffix.
+    buffer = BytesIO()
+    seen = {}
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for filename, xml_string in files:
+            count = seen.get(filename, 0)
+            seen[filename] = count + 1
+            if count:
+                path = PurePath(filename)
+                filename = f"{path.stem}_{count + 1}{path.suffix}"
+            archive.writestr(filename, xml_string)
+    return buffer.getvalue()